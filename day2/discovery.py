@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""Recursive file discovery with os.scandir (Day 2)
+
+Used by log_analyzer (--recursive) and exercises_day2.find_files_by_ext.
+File types come from the DirEntry (no extra stat call per entry); a stat is
+only made when an mtime filter is given. Paths are yielded directory by
+directory while the walk goes on, so callers can start on the first files
+right away. With `workers` the listings of the next subdirectories are read
+ahead in a thread pool (a few per worker, so a slow consumer also slows the
+walk), in the same order as the serial walk.
+
+Usage:
+  python discovery.py /var/log --include "*.log" --include "*.gz" --exclude "archive"
+  python discovery.py /var/log --newer-than 3600 --workers 8
+"""
+import argparse
+import concurrent.futures
+import fnmatch
+import os
+import re
+import time
+
+# with `workers`, at most this many listings per worker are read ahead of the consumer
+READ_AHEAD = 4
+
+
+def _glob_matcher(globs):
+    """One compiled regex for a list of shell globs, or None."""
+    if not globs:
+        return None
+    return re.compile('|'.join('(?:%s)' % fnmatch.translate(g) for g in globs)).match
+
+
+def _matches(match, name, rel):
+    return match(name) or match(rel)
+
+
+def _list_dir(path, rel, exclude):
+    """Read one directory; returns (files, subdirs) as lists of (path, rel, entry), sorted by name."""
+    files, dirs = [], []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                sub = entry.name if not rel else rel + '/' + entry.name
+                if exclude and _matches(exclude, entry.name, sub):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append((entry.path, sub, entry))
+                    elif entry.is_file():
+                        files.append((entry.path, sub, entry))
+                except OSError:
+                    continue
+    except OSError as e:
+        print('Error listing', path, e)
+    files.sort(key=lambda f: f[1])
+    dirs.sort(key=lambda d: d[1])
+    return files, dirs
+
+
+def iter_dirs(root, include=None, exclude=None, recursive=True, newer_than=None, older_than=None,
+              workers=None):
+    """Yield (dirpath, [file paths]) for `root` and, if `recursive`, every directory below it.
+
+    `include`/`exclude` are shell globs matched against a file's name or its
+    path relative to `root` ('2024/01/app.log'); excluded directories are not
+    entered. `newer_than`/`older_than` are epoch seconds bounding the mtime.
+    Symlinked directories are not followed.
+    """
+    include, exclude = _glob_matcher(include), _glob_matcher(exclude)
+
+    def keep(path, rel, entry):
+        if include and not _matches(include, entry.name, rel):
+            return False
+        if newer_than is not None or older_than is not None:
+            try:
+                mtime = entry.stat().st_mtime
+            except OSError:
+                return False
+            if newer_than is not None and mtime < newer_than:
+                return False
+            if older_than is not None and mtime > older_than:
+                return False
+        return True
+
+    def visit(listing):
+        files, dirs = listing
+        return [f[0] for f in files if keep(*f)], dirs if recursive else []
+
+    if not (workers and workers > 1):
+        stack = [(root, '')]
+        while stack:
+            path, rel = stack.pop()
+            files, dirs = visit(_list_dir(path, rel, exclude))
+            if files:
+                yield path, files
+            stack.extend((d[0], d[1]) for d in reversed(dirs))
+        return
+
+    # the same depth-first order; the directories next on the stack are listed ahead
+    limit = READ_AHEAD * workers
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as ex:
+        stack = [[root, '', None]]  # [path, rel, future once submitted]
+        pending = 0
+        while stack:
+            for item in reversed(stack):
+                if pending >= limit:
+                    break
+                if item[2] is None:
+                    item[2] = ex.submit(_list_dir, item[0], item[1], exclude)
+                    pending += 1
+            path, _, future = stack.pop()
+            pending -= 1
+            files, dirs = visit(future.result())
+            if files:
+                yield path, files
+            stack.extend([d[0], d[1], None] for d in reversed(dirs))
+
+
+def iter_files(root, **kwargs):
+    """Yield file paths below `root`; takes the same options as iter_dirs()."""
+    for _, files in iter_dirs(root, **kwargs):
+        yield from files
+
+
+def main():
+    p = argparse.ArgumentParser(description='List files below a directory')
+    p.add_argument('root', nargs='?', default='.')
+    p.add_argument('--include', action='append', help='Only files matching this glob (can repeat)')
+    p.add_argument('--exclude', action='append', help='Skip files and directories matching this glob (can repeat)')
+    p.add_argument('--no-recursive', action='store_true', help='Only list the top directory')
+    p.add_argument('--newer-than', type=float, metavar='SECONDS', help='Only files modified in the last SECONDS')
+    p.add_argument('--workers', type=int, help='Read directories with N threads')
+    args = p.parse_args()
+    newer = time.time() - args.newer_than if args.newer_than is not None else None
+    for f in iter_files(args.root, include=args.include, exclude=args.exclude, recursive=not args.no_recursive,
+                        newer_than=newer, workers=args.workers):
+        print(f)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,9 +4,12 @@
 - run_shell_cmd: execute a shell command and capture output
 """
 import configparser
+import glob
 import os
 import subprocess
 
+from discovery import iter_files
+
 
 def read_config(path):
     cp = configparser.ConfigParser()
@@ -14,13 +17,8 @@ def read_config(path):
     return {s: dict(cp[s]) for s in cp.sections()}
 
 
-def find_files_by_ext(root, ext):
-    matches = []
-    for dirpath, _, filenames in os.walk(root):
-        for fn in filenames:
-            if fn.endswith(ext):
-                matches.append(os.path.join(dirpath, fn))
-    return matches
+def find_files_by_ext(root, ext, workers=None):
+    return list(iter_files(root, include=['*' + glob.escape(ext)], workers=workers))
 
 
 def run_shell_cmd(cmd):
@@ -1,70 +1,1249 @@
 #!/usr/bin/env python3
-"""Log Analyzer Tool (Day 2)
+r"""Log Analyzer Tool (Day 2)
 
 Usage:
   python log_analyzer.py --dir logs/ --level ERROR --pattern "timeout" --export filtered.log
+  python log_analyzer.py --dir logs/ --pattern "timeout" --workers 8
+  python log_analyzer.py --dir logs/ --level ERROR --checkpoint state.json   # from cron
+  python log_analyzer.py --dir logs/ --level ERROR --follow
+  python log_analyzer.py index --dir logs/ --index logs.idx
+  python log_analyzer.py --dir logs/ --pattern "timeout" --index logs.idx
+  python log_analyzer.py --dir logs/ --pattern timeout --pattern OOM --pattern " 5\d\d " --export-dir by_pattern/
+  python log_analyzer.py --dir logs/ --level ERROR --top-templates 10
+  python log_analyzer.py --dir /var/log/app --recursive --include "*.log*" --exclude "debug" --level ERROR
+  python log_analyzer.py --dir logs/ --level ERROR --since "2024-01-01 14:02" --until "2024-01-01 14:10"
+  kubectl logs -f deploy/web | python log_analyzer.py --dir - --level ERROR
 """
 import argparse
-import glob
+import bz2
+import concurrent.futures
+import contextlib
+import datetime
+import ctypes
+import ctypes.util
+import gzip
+import hashlib
+import heapq
+import json
+import locale
+import lzma
+import mmap
 import os
 import re
-from collections import Counter
+import select
+import stat
+import sys
+import time
+from collections import Counter, deque
+
+from discovery import iter_dirs
+from log_templates import SpaceSaving, mask_template
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse
 
 
 LOG_LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
+LEVEL_RE = re.compile(r'\b(' + '|'.join(LOG_LEVELS) + r')\b')
+LEVEL_RE_B = re.compile(LEVEL_RE.pattern.encode('ascii'))
+# bytes regex matching the first level token of each line, one match per line
+FIRST_LEVEL_RE_B = re.compile(rb'(?m)^[^\n]*?' + LEVEL_RE_B.pattern)
+
+# non-ASCII letters that re.IGNORECASE matches to ASCII ones (İ and ı for i, K for k, ſ for s);
+# bytes regexes cannot see them, so pattern searches over buffers holding any use the text path
+FOLD_CHARS = '\u0130\u0131\u212a\u017f'
+
+# mmap'ed ranges are newline-counted in blocks of this size
+COUNT_BLOCK = 1024 * 1024
+
+REPEAT_OPS = tuple(getattr(sre_parse, n) for n in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT')
+                   if hasattr(sre_parse, n))
+
+# leading ISO-8601 timestamp: 2024-01-01 14:02:03.123, 2024-01-01T14:02:03Z, ...
+ISO_TS_RE = re.compile(rb'\s*(\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(?::\d{2}(?:[.,]\d+)?)?(?:Z|[+-]\d{2}:?\d{2})?)')
+
+# --top-templates K tracks this many times K templates, so counts for the top K stay tight
+TEMPLATE_CAPACITY_FACTOR = 20
+
+# checkpoint mode looks for the last complete line in blocks of this size
+TAIL_BLOCK = 64 * 1024
+
+# checkpoint mode hashes this many leading bytes of each plain file, to recognize
+# it after logrotate compresses it into a new archive
+HEAD_BLOCK = 4096
+
+# inotify events that mean new data: IN_MODIFY | IN_MOVED_TO | IN_CREATE
+IN_WATCH_MASK = 0x002 | 0x080 | 0x100
+
+COMPRESSED_MAGIC = [(b'\x1f\x8b', gzip.open), (b'BZh', bz2.open), (b'\xfd7zXZ\x00', lzma.open)]
+COMPRESSED_EXTS = ('.gz', '.bz2', '.xz')
+# app.log.1 / app.log-20240101: (base name, rotation number or date)
+ROTATED_RE = re.compile(r'^(.+?)[.-](\d+)$')
+
+# files larger than this are split into newline-aligned ranges when --workers is used
+CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def _decompressor(fh):
+    """Return gzip.open/bz2.open/lzma.open if the file starts with that format's magic bytes."""
+    head = fh.read(6)
+    fh.seek(0)
+    for magic, opener in COMPRESSED_MAGIC:
+        if head.startswith(magic):
+            return opener
+    return None
+
+
+def _rotation_key(path):
+    """Sort key putting rotated logs in chronological order.
+
+    app.log.3.gz, app.log.2.gz, app.log.1, app.log (numeric suffixes count
+    backwards); date suffixes such as app.log-20240101.gz sort forwards.
+    """
+    name = os.path.basename(path)
+    for ext in COMPRESSED_EXTS:
+        if name.endswith(ext):
+            name = name[:-len(ext)]
+            break
+    m = ROTATED_RE.match(name)
+    if not m:
+        return os.path.dirname(path), name, 1, 0
+    num = m.group(2)
+    return os.path.dirname(path), m.group(1), 0, int(num) if len(num) >= 8 else -int(num)
+
+
+def _log_files(path, recursive=False, include=None, exclude=None):
+    """Yield the log files in `path` (and its subdirectories if `recursive`), each
+    directory's files in rotation order. Hidden files are skipped, as with glob('*').
+    """
+    for _, files in iter_dirs(path, include=include, exclude=['.*'] + (exclude or []), recursive=recursive):
+        yield from sorted(files, key=_rotation_key)
+
+
+def _split_ranges(path, start=0, end=None, chunk_size=CHUNK_SIZE):
+    """Split bytes [start, end) of a file into ranges that begin and end on line boundaries.
+
+    Compressed files cannot be split and come back as a single range.
+    """
+    size = os.path.getsize(path) if end is None else end
+    ranges = []
+    with open(path, 'rb') as fh:
+        if _decompressor(fh):
+            return [(start, size)]
+        while start < size:
+            stop = start + chunk_size
+            if stop >= size:
+                stop = size
+            else:
+                fh.seek(stop)
+                fh.readline()
+                stop = min(fh.tell(), size)
+            ranges.append((start, stop))
+            start = stop
+    return ranges
+
+
+def _ascii_compatible(encoding):
+    try:
+        return '\nERROR'.encode(encoding) == b'\nERROR'
+    except LookupError:
+        return False
+
+
+def _literal_runs(parsed):
+    runs, cur = [], []
+    for op, av in parsed:
+        if op is sre_parse.LITERAL and av < 128:
+            cur.append(chr(av))
+            continue
+        if op is sre_parse.AT:
+            continue  # anchors do not consume text
+        runs.append(''.join(cur))
+        cur = []
+        if op is sre_parse.SUBPATTERN:
+            runs.extend(_literal_runs(av[-1]))
+        elif op is getattr(sre_parse, 'ATOMIC_GROUP', None):
+            runs.extend(_literal_runs(av))
+        elif op in REPEAT_OPS and av[0] >= 1:
+            runs.extend(_literal_runs(av[2]))
+    runs.append(''.join(cur))
+    return runs
+
+
+def required_literals(pattern):
+    """Return ASCII substrings that every match of `pattern` must contain.
+
+    Alternations and optional parts contribute nothing, so an empty list means
+    every line has to be checked with the full regex.
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except (re.error, OverflowError, RecursionError):
+        return []
+    return [lit for lit in _literal_runs(parsed) if lit]
+
+
+def _trie_regex(words):
+    """Regex source matching any of `words`, factored on common prefixes.
+
+    A plain alternation makes the engine try every word at every position; the
+    trie form branches on one character at a time, so the cost grows with the
+    length of the words rather than their number. Longer words are tried first.
+    """
+    trie = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[''] = {}
+
+    def build(node):
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        return '(?:' + body + ')?' if '' in node else body
+
+    return build(trie)
+
+
+class PatternSet:
+    """Several regexes checked in one pass over the data.
+
+    Each pattern's longest required literal goes into one combined prefix-trie
+    regex that is run once per line (or once over a whole buffer); only patterns
+    whose literal was found, plus patterns without any literal, are evaluated.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self.regexes = [re.compile(p, re.IGNORECASE) for p in self.patterns]
+        by_literal = {}
+        self.always = []
+        for i, p in enumerate(self.patterns):
+            lits = required_literals(p)
+            if lits:
+                by_literal.setdefault(max(lits, key=len).lower(), []).append(i)
+            else:
+                self.always.append(i)
+        # longest first, so the literal reported at a position implies all its prefixes
+        ordered = sorted(by_literal, key=len, reverse=True)
+        self.implied = {lit: sorted({i for other in ordered if lit.startswith(other) for i in by_literal[other]})
+                        for lit in ordered}
+        self.literal_indexes = [i for i in range(len(self.patterns)) if i not in self.always]
+        alternation = _trie_regex(ordered)
+        self.prefilter = re.compile('(?=(%s))' % alternation, re.IGNORECASE) if ordered else None
+
+        # bytes regexes that find every candidate line in a whole buffer, or None
+        self.buffer_regexes = None
+        sources = [re.compile(alternation.encode('ascii'), re.IGNORECASE)] if ordered else []
+        for i in self.always:
+            compiled = _bytes_patterns(self.patterns[i])
+            if compiled is None:
+                break
+            sources.append(compiled[1])
+        else:
+            self.buffer_regexes = sources
+
+    def hits(self, line):
+        """Return the indexes of the patterns that match `line`."""
+        candidates = set(self.always)
+        if self.prefilter:
+            for m in self.prefilter.finditer(line):
+                implied = self.implied.get(m.group(1).lower())
+                if implied is None:
+                    # a Unicode case fold (ſ for s, K for k) matched: try every literal pattern
+                    candidates.update(self.literal_indexes)
+                    break
+                candidates.update(implied)
+        return [i for i in sorted(candidates) if self.regexes[i].search(line)]
+
+
+def load_patterns(path):
+    """Read one regex per line, skipping blank lines and # comments."""
+    with open(path) as fh:
+        return [l.rstrip('\n') for l in fh if l.strip() and not l.lstrip().startswith('#')]
+
+
+def _bytes_patterns(pattern):
+    """Compile `pattern` for the bytes fast path.
+
+    Returns (per_line, whole_buffer) regexes, or None when the pattern cannot be
+    run on raw bytes (non-ASCII, or anchored to the start/end of the text).
+    """
+    if not pattern:
+        return None, None
+    if not pattern.isascii() or '\\A' in pattern or '\\Z' in pattern:
+        return None
+    raw = pattern.encode('ascii')
+    try:
+        return re.compile(raw, re.IGNORECASE), re.compile(_crlf_anchors(raw), re.IGNORECASE | re.MULTILINE)
+    except re.error:
+        return None
 
 
-def analyze_logs(path, level=None, pattern=None):
-    files = glob.glob(os.path.join(path, '*'))
+def _crlf_anchors(raw):
+    """Rewrite each `$` of a bytes pattern so it also matches before a CRLF line end.
+
+    Lines are matched without their '\\r' (as text mode reads them), but the
+    whole-buffer search runs over the raw bytes.
+    """
+    out = bytearray()
+    i = 0
+    in_class = False
+    while i < len(raw):
+        c = raw[i:i + 1]
+        if c == b'\\':
+            out += raw[i:i + 2]
+            i += 2
+            continue
+        i += 1
+        if in_class:
+            in_class = c != b']'
+        elif c == b'[':
+            in_class = True
+            # a ']' first in the class is a literal
+            for lead in (b'^', b']'):
+                if raw[i:i + 1] == lead:
+                    c += lead
+                    i += 1
+        elif c == b'$':
+            c = rb'(?=\r?$)'
+        out += c
+    return bytes(out)
+
+
+def _text_line(buf, ls, le, end):
+    """buf[ls:le] with its newline, a CRLF ending read as LF like text mode does."""
+    line = buf[ls:min(le + 1, end)]
+    if line.endswith(b'\r\n'):
+        return line[:-2] + b'\n'
+    return line
+
+
+def _line_bounds(buf, pos, start, end):
+    """Return (line_start, line_end) of the line containing `pos`; line_end excludes the newline."""
+    ls = buf.rfind(b'\n', start, pos) + 1 or start
+    le = buf.find(b'\n', pos, end)
+    return ls, (end if le == -1 else le)
+
+
+def _lines(buf, start, end):
+    pos = start
+    while pos < end:
+        le = buf.find(b'\n', pos, end)
+        if le == -1:
+            le = end
+        yield pos, le
+        pos = le + 1
+
+
+def _level_spans(buf, start, end, level_b, counts):
+    """Yield spans of lines whose first level token is `level_b` or that have none.
+
+    Levels are counted into `counts` on the way, so no separate counting pass is needed.
+    """
+    pos = start
+    for m in FIRST_LEVEL_RE_B.finditer(buf, start, end):
+        ls = m.start()
+        if ls > pos:
+            yield from _lines(buf, pos, ls)
+        tok = m.group(1)
+        counts[tok] += 1
+        le = buf.find(b'\n', m.end(), end)
+        if le == -1:
+            le = end
+        if tok == level_b:
+            yield ls, le
+        pos = le + 1
+    if pos < end:
+        yield from _lines(buf, pos, end)
+
+
+def _count_range(buf, start, end, counts=None):
+    """Return (total_lines, level Counter) for buf[start:end], one block at a time.
+
+    If `counts` is given the levels were already counted and only lines are counted.
+    """
     total = 0
-    counts = Counter()
-    matches = []
+    count_levels = counts is None
+    if count_levels:
+        counts = Counter()
+    pos = start
+    while pos < end:
+        stop = buf.find(b'\n', min(pos + COUNT_BLOCK, end), end) + 1 or end
+        total += buf[pos:stop].count(b'\n')
+        if count_levels:
+            counts.update(FIRST_LEVEL_RE_B.findall(buf, pos, stop))
+        pos = stop
+    if end > start and buf[end - 1:end] != b'\n':
+        total += 1
+    return total, counts
 
-    level_re = re.compile(r'\b(' + '|'.join(LOG_LEVELS) + r')\b')
-    pattern_re = re.compile(pattern, re.IGNORECASE) if pattern else None
 
-    for f in files:
+def _search_lines(buf, start, end, regex):
+    """Yield (line_start, line_end) of each line in buf[start:end] where `regex` finds a match."""
+    pos = start
+    while pos < end:
+        m = regex.search(buf, pos, end)
+        if not m:
+            return
+        ls, le = _line_bounds(buf, m.start(), start, end)
+        yield ls, le
+        pos = le + 1
+
+
+def _level_ok(line, level_b):
+    if not level_b:
+        return True
+    m = LEVEL_RE_B.search(line)
+    return not m or m.group(1) == level_b
+
+
+def _matching_spans(buf, start, end, level, patterns):
+    """Yield (line_start, line_end) of matching lines in buf[start:end]."""
+    per_line, whole = patterns
+    if whole is None:
+        yield from _lines(buf, start, end)
+        return
+    # search the whole buffer, then confirm each candidate on its own line
+    level_b = level.encode('ascii') if level else None
+    for ls, le in _search_lines(buf, start, end, whole):
+        line = _text_line(buf, ls, le, end)
+        if per_line.search(line) and _level_ok(line, level_b):
+            yield ls, le
+
+
+def _candidate_spans(buf, start, end, level, matcher):
+    """Yield lines of buf[start:end] that a PatternSet may match, in order and once each."""
+    level_b = level.encode('ascii') if level else None
+    last = -1
+    sources = [_search_lines(buf, start, end, r) for r in matcher.buffer_regexes]
+    for ls, le in heapq.merge(*sources):
+        if ls == last:
+            continue
+        last = ls
+        if _level_ok(buf[ls:min(le + 1, end)], level_b):
+            yield ls, le
+
+
+def _has_folds(buf, start, end, encoding):
+    """True if buf[start:end] contains any of FOLD_CHARS in `encoding`."""
+    for ch in FOLD_CHARS:
         try:
-            with open(f, 'r', errors='ignore') as fh:
-                for line in fh:
+            if buf.find(ch.encode(encoding), start, end) != -1:
+                return True
+        except UnicodeEncodeError:
+            continue
+    return False
+
+
+def _map_file(fh, end):
+    """mmap an open file; returns (buffer, end) or None if the text path should be used."""
+    try:
+        buf = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, OSError):
+        return None
+    if buf[:2] in (b'\xff\xfe', b'\xfe\xff'):
+        # UTF-16/32 byte order mark: leave it to the text path
+        buf.close()
+        return None
+    end = len(buf) if end is None else min(end, len(buf))
+    return buf, end
+
+
+def _iter_range(path, start=0, end=None, top_templates=None, stats=None, **opts):
+    """Yield the matches of _match_range(); with `top_templates` (sketch capacity)
+    their masked templates are also counted into stats['templates'].
+    """
+    if not top_templates:
+        yield from _match_range(path, start, end, stats=stats, **opts)
+        return
+    sketch = SpaceSaving(top_templates)
+    try:
+        for item in _match_range(path, start, end, stats=stats, **opts):
+            sketch.add(mask_template(item[0] if isinstance(item, tuple) else item))
+            yield item
+    finally:
+        if stats is not None:
+            _add_stats(stats, 0, (), sketch)
+
+
+def _match_range(path, start=0, end=None, level=None, pattern=None, use_mmap=True, window=None,
+                 stats=None):
+    """Yield the matching lines in bytes [start, end) of `path`.
+
+    Line and level totals are added to `stats` when the generator finishes.
+    Used by both the serial and the parallel path so their output is identical.
+
+    ASCII-compatible files are memory-mapped and searched with bytes regexes over
+    the whole buffer; only matching lines are decoded. Other encodings and
+    patterns that cannot run on bytes use the line-by-line text path.
+    gzip/bz2/xz files (detected by magic bytes) are always streamed whole, and
+    `window` (since, until, formats) is applied to them line by line; plain files
+    are clipped to the window before they get here.
+
+    A list of patterns is matched in one pass with a PatternSet; (line, hits)
+    pairs are yielded instead of lines, hits being the matching pattern indexes.
+    """
+    encoding = locale.getpreferredencoding(False)
+    matcher = PatternSet(pattern) if isinstance(pattern, (list, tuple)) else None
+    if not (use_mmap and _ascii_compatible(encoding)):
+        patterns = None
+    elif matcher:
+        patterns = (None, None) if matcher.buffer_regexes is not None else None
+    else:
+        patterns = _bytes_patterns(pattern)
+    total = 0
+    counts = Counter()
+
+    try:
+        with open(path, 'rb') as fh:
+            opener = _decompressor(fh)
+            mapped = _map_file(fh, end) if patterns and not opener else None
+            if mapped and pattern and _has_folds(mapped[0], start, mapped[1], encoding):
+                mapped[0].close()
+                mapped = None
+            if mapped:
+                buf, end = mapped
+                with buf:
+                    found = None
+                    if matcher:
+                        for ls, le in _candidate_spans(buf, start, end, level, matcher):
+                            line = buf[ls:le].decode(encoding, 'ignore').rstrip('\r\n')
+                            hits = matcher.hits(line)
+                            if hits:
+                                yield line, hits
+                    else:
+                        if level and patterns[1] is None:
+                            found = Counter()
+                            spans = _level_spans(buf, start, end, level.encode('ascii'), found)
+                        else:
+                            spans = _matching_spans(buf, start, end, level, patterns)
+                        for ls, le in spans:
+                            yield buf[ls:le].decode(encoding, 'ignore').rstrip('\r\n')
+                    total, found = _count_range(buf, start, end, found)
+                    for tok, n in found.items():
+                        counts[tok.decode('ascii')] = n
+                return
+
+            pattern_re = re.compile(pattern, re.IGNORECASE) if pattern and not matcher else None
+            parse = None
+            if opener:
+                end = None  # `start` counts decompressed bytes
+                if window:
+                    since, until, formats = window
+                    parse = make_time_parser(formats)
+                    keep = since is None
+            fh.seek(0 if opener else start)
+            with (opener(fh, 'rb') if opener else contextlib.nullcontext(fh)) as stream:
+                if opener and start:
+                    stream.seek(start)
+                pos = start
+                while end is None or pos < end:
+                    raw = stream.readline()
+                    if not raw:
+                        break
+                    pos += len(raw)
+                    if raw.endswith(b'\r\n'):
+                        raw = raw[:-2] + b'\n'
+                    if parse:
+                        # untimestamped lines follow the record they continue
+                        ts = parse(raw)
+                        if ts is not None:
+                            if until is not None and ts > until:
+                                break
+                            keep = since is None or ts >= since
+                        if not keep:
+                            continue
+                    line = raw.decode(encoding, 'ignore')
                     total += 1
-                    m = level_re.search(line)
+                    m = LEVEL_RE.search(line)
                     if m:
                         counts[m.group(1)] += 1
                         if level and m.group(1) != level:
                             continue
+                    if matcher:
+                        hits = matcher.hits(line)
+                        if hits:
+                            yield line.rstrip('\r\n'), hits
+                        continue
                     if pattern_re and not pattern_re.search(line):
                         continue
-                    matches.append(line.rstrip('\n'))
+                    yield line.rstrip('\r\n')
+    finally:
+        if stats is not None:
+            _add_stats(stats, total, counts)
+
+
+def _add_stats(stats, total, counts, templates=None):
+    stats['total_lines'] = stats.get('total_lines', 0) + total
+    stats.setdefault('level_counts', Counter()).update(counts)
+    if templates is not None:
+        if stats.get('templates') is None:
+            stats['templates'] = SpaceSaving(templates.capacity)
+        stats['templates'].merge(templates)
+
+
+def _add_to_sinks(stats, sinks, total, counts, templates):
+    """Add a range's totals to its sinks; matched templates always reach `stats`
+    (index candidate blocks have no sinks, but their matches are new)."""
+    for dest in sinks:
+        _add_stats(dest, total, counts, templates)
+    if templates is not None and not any(dest is stats for dest in sinks):
+        _add_stats(stats, 0, (), templates)
+
+
+def _scan_task(task):
+    """Worker entry point: scan one range and return (total, counts, templates, matches)."""
+    path, start, end, opts = task
+    stats = {}
+    matches = []
+    try:
+        matches.extend(_iter_range(path, start, end, stats=stats, **opts))
+    except IsADirectoryError:
+        pass
+    except Exception as e:
+        print('Error reading', path, e)
+    return stats.get('total_lines', 0), stats.get('level_counts', Counter()), stats.get('templates'), matches
+
+
+def _build_tasks(spans, opts):
+    """Split spans into pool tasks; yields (task, sinks) pairs."""
+    for f, start, end, sinks in spans:
+        try:
+            ranges = _split_ranges(f, start, end)
         except IsADirectoryError:
             continue
         except Exception as e:
             print('Error reading', f, e)
+            continue
+        for s, e in ranges:
+            yield (f, s, e, opts), sinks
+
+
+def _ordered_map(ex, fn, items, window):
+    """Like Executor.map over (arg, extra) pairs, yielding (extra, fn(arg)) in order;
+    keeps at most `window` results in flight."""
+    pending = deque()
+    for arg, extra in items:
+        pending.append((extra, ex.submit(fn, arg)))
+        if len(pending) >= window:
+            extra, future = pending.popleft()
+            yield extra, future.result()
+    while pending:
+        extra, future = pending.popleft()
+        yield extra, future.result()
+
+
+def _naive(ts):
+    """Timezone-aware timestamps are compared in UTC; naive ones as they are."""
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+def parse_when(text):
+    """Parse a --since/--until value: ISO-8601, or HH:MM[:SS] meaning today."""
+    try:
+        return _naive(datetime.datetime.fromisoformat(text))
+    except ValueError:
+        t = datetime.time.fromisoformat(text)
+        return datetime.datetime.combine(datetime.date.today(), t)
+
+
+def make_time_parser(formats=None):
+    """Return parse(line_bytes) -> datetime or None for a line's leading timestamp.
+
+    ISO-8601 by default; otherwise each strptime format is tried in turn on the
+    first words of the line.
+    """
+    if not formats:
+        def parse(line):
+            m = ISO_TS_RE.match(line)
+            if not m:
+                return None
+            try:
+                return _naive(datetime.datetime.fromisoformat(m.group(1).decode('ascii').replace(',', '.')))
+            except ValueError:
+                return None
+        return parse
+
+    # compare as many whitespace-separated words as the format produces
+    sample = datetime.datetime(2000, 12, 28, 23, 59, 59, 999999)
+    words = [(fmt, len(sample.strftime(fmt).split())) for fmt in formats]
+    most = max(n for _, n in words)
+
+    def parse(line):
+        head = line.decode('ascii', 'ignore').split(None, most)
+        for fmt, n in words:
+            try:
+                return _naive(datetime.datetime.strptime(' '.join(head[:n]), fmt))
+            except ValueError:
+                continue
+        return None
+    return parse
+
+
+def _probe(fh, pos, lo, end, parse):
+    """Find the first timestamped line starting at or after `pos`; returns (ts, line_end) or (None, end)."""
+    if pos > lo:
+        fh.seek(pos - 1)
+        fh.readline()
+    else:
+        fh.seek(lo)
+    ls = fh.tell()
+    while ls < end:
+        line = fh.readline()
+        if not line:
+            break
+        ts = parse(line)
+        ls += len(line)
+        if ts is not None:
+            return ts, ls
+    return None, end
+
+
+def _bisect_time(fh, lo, hi, parse, before):
+    """Binary-search byte offsets for the first line in [lo, hi) whose timestamp is not before(ts)."""
+    start, end = lo, hi
+    while lo < hi:
+        mid = (lo + hi) // 2
+        ts, line_end = _probe(fh, mid, start, end, parse)
+        if ts is None or not before(ts):
+            hi = mid
+        else:
+            lo = line_end
+    return lo
+
+
+def _time_window(path, since, until, parse):
+    """Byte range [start, end) of a time-ordered file holding lines from `since` to `until`.
+
+    Compressed files cannot be searched and return None; their lines are
+    filtered while streaming instead.
+    """
+    with open(path, 'rb') as fh:
+        if _decompressor(fh):
+            return None
+        size = os.fstat(fh.fileno()).st_size
+        start = _bisect_time(fh, 0, size, parse, lambda ts: ts < since) if since else 0
+        end = _bisect_time(fh, start, size, parse, lambda ts: ts <= until) if until else size
+    return start, end
+
+
+def _narrow_spans(spans, window):
+    """Clip each span to the part of its file inside the --since/--until window."""
+    since, until, formats = window
+    parse = make_time_parser(formats)
+    cache = {}
+    for f, start, end, sinks in spans:
+        if f not in cache:
+            try:
+                cache[f] = _time_window(f, since, until, parse)
+            except IsADirectoryError:
+                cache[f] = (0, 0)
+            except Exception as e:
+                print('Error reading', f, e)
+                cache[f] = (0, 0)
+        bounds = cache[f]
+        if bounds is None:
+            yield f, start, end, sinks
+            continue
+        lo = max(start, bounds[0])
+        hi = bounds[1] if end is None else min(end, bounds[1])
+        if lo < hi:
+            yield f, lo, hi, sinks
+
+
+def load_checkpoint(path):
+    """Load per-file scan state written by save_checkpoint(); a missing or corrupt file gives {}."""
+    try:
+        with open(path) as fh:
+            state = json.load(fh)
+    except (OSError, ValueError):
+        return {}
+    for entry in state.values():
+        entry['level_counts'] = Counter(entry.get('level_counts', {}))
+        if entry.get('templates'):
+            entry['templates'] = SpaceSaving.from_dict(entry['templates'])
+    return state
+
+
+def save_checkpoint(state, path):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as fh:
+        json.dump(state, fh, default=SpaceSaving.to_dict)
+    os.replace(tmp, path)
+
+
+def _last_newline_end(path, start, size):
+    """Offset just past the last newline in bytes [start, size) of `path`, or `start` if none."""
+    with open(path, 'rb') as fh:
+        pos = size
+        while pos > start:
+            step = min(TAIL_BLOCK, pos - start)
+            fh.seek(pos - step)
+            i = fh.read(step).rfind(b'\n')
+            if i != -1:
+                return pos - step + i + 1
+            pos -= step
+    return start
+
+
+def _archived_entry(path, opener, candidates):
+    """Return the checkpoint entry of the plain file that archive `path` was compressed from, or None."""
+    with opener(path, 'rb') as stream:
+        head = stream.read(HEAD_BLOCK)
+    for entry in candidates:
+        n = entry['head_size']
+        if len(head) >= n and hashlib.sha1(head[:n]).hexdigest() == entry['head']:
+            return entry
+    return None
+
+
+def _file_spans(files, checkpoint=None):
+    """Return (path, start, end, entry) for each file to scan.
+
+    Without a checkpoint every file is scanned whole (lazily, as `files` are
+    found). With one, only complete
+    lines appended since the recorded offset are scanned; a file whose inode
+    changed or that shrank is rescanned from 0, and a file that was renamed
+    (rotated) keeps the offset recorded under its old name. Compressed files
+    are scanned once and again only if their size changes; an archive that
+    starts with the same bytes as a file of the same rotation set in the
+    checkpoint (logrotate's compress) is read on from that file's offset.
+    """
+    if checkpoint is None:
+        return ((f, 0, None, None) for f in files)
+
+    by_inode = {e['inode']: e for e in checkpoint.values()}
+    by_head = {}
+    for key, e in checkpoint.items():
+        if e.get('head'):
+            by_head.setdefault(_rotation_key(key)[:2], []).append(e)
+    seen = {}
+    spans = []
+    for f in files:
+        key = os.path.abspath(f)
+        try:
+            st = os.stat(f)
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            entry = checkpoint.get(key)
+            if not entry or entry['inode'] != st.st_ino:
+                entry = by_inode.get(st.st_ino)
+            if entry and entry['inode'] == st.st_ino and st.st_size >= entry['offset']:
+                entry = dict(entry)
+            else:
+                entry = {'inode': st.st_ino, 'offset': 0, 'total_lines': 0, 'level_counts': Counter()}
+            with open(f, 'rb') as fh:
+                opener = _decompressor(fh)
+                head = fh.read(HEAD_BLOCK)
+            if opener:
+                # rotated archives are immutable: scan once, rescan whole if they change
+                if entry['offset'] == st.st_size:
+                    start = end = st.st_size
+                else:
+                    origin = _archived_entry(f, opener, by_head.get(_rotation_key(key)[:2], ()))
+                    if origin:
+                        entry = {k: v for k, v in origin.items() if k not in ('head', 'head_size')}
+                        start = entry['offset']
+                    else:
+                        entry = {'inode': st.st_ino, 'offset': 0, 'total_lines': 0, 'level_counts': Counter()}
+                        start = 0
+                    entry['inode'] = st.st_ino
+                    end = st.st_size
+                    # offsets in archives count decompressed bytes; the range runs to the end
+                    spans.append((f, start, end, entry))
+            else:
+                start = entry['offset']
+                end = _last_newline_end(f, start, st.st_size)
+                if head:
+                    entry.update(head=hashlib.sha1(head).hexdigest(), head_size=len(head))
+                if end > start:
+                    spans.append((f, start, end, entry))
+        except Exception as e:
+            print('Error reading', f, e)
+            continue
+        entry.update(size=st.st_size, offset=end)
+        seen[key] = entry
+    checkpoint.clear()
+    checkpoint.update(seen)
+    return spans
+
 
-    return {'total_lines': total, 'level_counts': dict(counts), 'matches': matches}
+def iter_matches(path, level=None, pattern=None, workers=None, stats=None, use_mmap=True,
+                 checkpoint=None, index=None, since=None, until=None, time_formats=None,
+                 top_templates=None, recursive=False, include=None, exclude=None):
+    """Yield matching lines from every file in `path` as they are found.
 
+    With `recursive` subdirectories are searched too; `include`/`exclude` are
+    globs selecting files (see discovery.iter_dirs). Scanning starts on the
+    first files while the rest of the tree is still being listed.
 
-def save_matches(matches, dest):
-    with open(dest, 'w') as fh:
+    If `stats` is a dict, 'total_lines' and 'level_counts' are accumulated in it.
+    With `workers` > 1 files (and ranges of large files) are scanned in a process
+    pool; results are yielded in file order so the output matches the serial path.
+    `use_mmap=False` forces the line-by-line text path.
+
+    `pattern` may be a list of regexes: they are all matched in the same pass
+    and (line, [indexes of matching patterns]) pairs are yielded.
+
+    `checkpoint` is a state dict from load_checkpoint(): only bytes appended since
+    the previous run are scanned, and the state is updated in place (per-file
+    offsets and cumulative counts) for save_checkpoint().
+
+    `index` is a trigram index built by log_index.build_index(); when the pattern
+    has literal text only the candidate blocks it names are read.
+
+    `since`/`until` (datetimes) limit the scan to that time window: each
+    time-ordered file is binary-searched on byte offsets for the window's
+    first and last line, using the leading timestamp of each line
+    (`time_formats` are strptime formats, ISO-8601 by default). The index is
+    not used together with a window.
+
+    `top_templates` is the capacity of a Space-Saving sketch of masked message
+    templates of the matched lines; the merged sketch ends up in
+    stats['templates'] (and per file in the checkpoint).
+    """
+    files = _log_files(path, recursive, include, exclude)
+    if stats is None:
+        stats = {}
+    stats.setdefault('total_lines', 0)
+    stats.setdefault('level_counts', Counter())
+    window = (since, until, time_formats) if since or until else None
+    opts = {'level': level, 'pattern': pattern, 'use_mmap': use_mmap, 'window': window,
+            'top_templates': top_templates}
+
+    # spans are (path, start, end, sinks): the stats dicts a range's totals go to
+    spans = None
+    if index and pattern and checkpoint is None and not window:
+        import log_index
+        spans = log_index.plan(index, files, pattern, stats)
+    if spans is None:
+        spans = [(f, start, end, [stats] if entry is None else [stats, entry])
+                 for f, start, end, entry in _file_spans(files, checkpoint)]
+        if window:
+            spans = _narrow_spans(spans, window)
+
+    if not (workers and workers > 1):
+        for f, start, end, sinks in spans:
+            fstats = {}
+            try:
+                yield from _iter_range(f, start, end, stats=fstats, **opts)
+            except IsADirectoryError:
+                continue
+            except Exception as e:
+                print('Error reading', f, e)
+            finally:
+                if fstats:
+                    _add_to_sinks(stats, sinks, fstats['total_lines'], fstats['level_counts'], fstats.get('templates'))
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as ex:
+        results = _ordered_map(ex, _scan_task, _build_tasks(spans, opts), workers * 2)
+        for sinks, (total, counts, templates, matches) in results:
+            _add_to_sinks(stats, sinks, total, counts, templates)
+            yield from matches
+
+
+def _inotify_watch(path):
+    """Return an inotify fd watching directory `path`, or None when inotify is unavailable."""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, os.fsencode(path), IN_WATCH_MASK) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+def _wait_for_changes(fd, timeout):
+    """Block until inotify reports a change (or `timeout` passes); plain sleep without inotify."""
+    if fd is None:
+        time.sleep(timeout)
+        return
+    if select.select([fd], [], [], timeout)[0]:
+        try:
+            while os.read(fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+
+
+def follow(path, level=None, pattern=None, checkpoint=None, interval=1.0, use_mmap=True,
+           on_idle=None, recursive=False, include=None, exclude=None):
+    """Yield matching lines as they are appended to files in `path`; runs until interrupted.
+
+    New data is picked up through inotify when available, otherwise by stat
+    polling every `interval` seconds. Without prior `checkpoint` state existing
+    content is skipped, like `tail -f`. `on_idle(checkpoint)` is called after
+    each pass, e.g. to persist the checkpoint. inotify only watches the top
+    directory; files in subdirectories (`recursive`) are seen on the next poll.
+    """
+    if checkpoint is None:
+        checkpoint = {}
+    if not checkpoint:
+        _file_spans(_log_files(path, recursive, include, exclude), checkpoint)
+    fd = _inotify_watch(path)
+    try:
+        while True:
+            yield from iter_matches(path, level, pattern, checkpoint=checkpoint, use_mmap=use_mmap,
+                                    recursive=recursive, include=include, exclude=exclude)
+            if on_idle:
+                on_idle(checkpoint)
+            _wait_for_changes(fd, interval)
+    finally:
+        if fd is not None:
+            os.close(fd)
+
+
+def analyze_logs(path, level=None, pattern=None, workers=None, use_mmap=True, recursive=False):
+    stats = {}
+    matches = list(iter_matches(path, level, pattern, workers, stats, use_mmap, recursive=recursive))
+    res = {'total_lines': stats['total_lines'], 'level_counts': dict(stats['level_counts'])}
+    if isinstance(pattern, (list, tuple)):
+        res['pattern_counts'] = count_by_pattern(matches, pattern)
+        matches = [line for line, _ in matches]
+    res['matches'] = matches
+    return res
+
+
+def filter_lines(lines, level=None, pattern=None, stats=None):
+    """Yield the text lines from an iterable that pass `level` and `pattern`.
+
+    The line-by-line filter of iter_matches() for streams that are not files
+    (stdin, `container_manager.py logs --follow`). With a list of patterns,
+    (line, hits) pairs are yielded. Totals go into `stats` as lines are read.
+    """
+    matcher = PatternSet(pattern) if isinstance(pattern, (list, tuple)) else None
+    pattern_re = re.compile(pattern, re.IGNORECASE) if pattern and not matcher else None
+    if stats is None:
+        stats = {}
+    stats.setdefault('total_lines', 0)
+    counts = stats.setdefault('level_counts', Counter())
+    for line in lines:
+        line = line.rstrip('\r\n')
+        stats['total_lines'] += 1
+        m = LEVEL_RE.search(line)
+        if m:
+            counts[m.group(1)] += 1
+            if level and m.group(1) != level:
+                continue
+        if matcher:
+            hits = matcher.hits(line)
+            if hits:
+                yield line, hits
+            continue
+        if pattern_re and not pattern_re.search(line):
+            continue
+        yield line
+
+
+def _stdin_main(args):
+    stats = {}
+    out = open(args.export, 'a') if args.export else sys.stdout
+    try:
+        for item in filter_lines(sys.stdin, args.level, args.pattern, stats):
+            out.write((item[0] if isinstance(item, tuple) else item) + '\n')
+            if out is sys.stdout:
+                out.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print('Total lines scanned:', stats['total_lines'], file=sys.stderr)
+    print('Counts by level:', dict(stats['level_counts']), file=sys.stderr)
+
+
+def count_by_pattern(pairs, patterns):
+    """Count (line, hits) pairs per pattern."""
+    counts = Counter(i for _, hits in pairs for i in hits)
+    return {p: counts[i] for i, p in enumerate(patterns)}
+
+
+def split_by_pattern(pairs, dest_dir, patterns, counts=None):
+    """Pass (line, hits) pairs through as lines, writing each line to a file per matching pattern.
+
+    Files are DEST_DIR/pattern_<n>.log; DEST_DIR/patterns.txt maps n to the
+    regex. If `counts` is a Counter the per-pattern totals are added to it.
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    with open(os.path.join(dest_dir, 'patterns.txt'), 'w') as fh:
+        fh.writelines('%d\t%s\n' % (i, p) for i, p in enumerate(patterns))
+    files = {}
+    try:
+        for line, hits in pairs:
+            for i in hits:
+                fh = files.get(i)
+                if fh is None:
+                    fh = files[i] = open(os.path.join(dest_dir, 'pattern_%d.log' % i), 'w')
+                fh.write(line + '\n')
+            if counts is not None:
+                counts.update(hits)
+            yield line
+    finally:
+        for fh in files.values():
+            fh.close()
+
+
+def _count_hits(pairs, counts):
+    for line, hits in pairs:
+        counts.update(hits)
+        yield line
+
+
+def save_matches(matches, dest, batch=10000):
+    """Write lines to `dest` in buffered batches as they arrive; returns the count.
+
+    The file is only created once there is something to write.
+    """
+    fh = None
+    n = 0
+    buf = []
+    try:
         for l in matches:
-            fh.write(l + '\n')
+            buf.append(l)
+            if len(buf) >= batch:
+                if fh is None:
+                    fh = open(dest, 'w', buffering=1024 * 1024)
+                fh.write('\n'.join(buf) + '\n')
+                n += len(buf)
+                buf.clear()
+        if buf:
+            if fh is None:
+                fh = open(dest, 'w', buffering=1024 * 1024)
+            fh.write('\n'.join(buf) + '\n')
+            n += len(buf)
+    finally:
+        if fh is not None:
+            fh.close()
+    return n
+
+
+def _print_templates(title, sketch, k):
+    print(title)
+    if sketch is None:
+        return
+    for template, count, error in sketch.top(k):
+        print('  %8d  (+/- %d)  %s' % (count, error, template))
+
+
+def _follow_main(args, checkpoint):
+    out = open(args.export, 'a') if args.export else sys.stdout
+
+    def on_idle(state):
+        out.flush()
+        if args.checkpoint:
+            save_checkpoint(state, args.checkpoint)
+
+    try:
+        for item in follow(args.dir, level=args.level, pattern=args.pattern, checkpoint=checkpoint,
+                           interval=args.interval, use_mmap=not args.no_mmap, on_idle=on_idle,
+                           recursive=args.recursive, include=args.include, exclude=args.exclude):
+            out.write((item[0] if isinstance(item, tuple) else item) + '\n')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if out is not sys.stdout:
+            out.close()
 
 
 def main():
     p = argparse.ArgumentParser(description='Analyze logs in a directory')
-    p.add_argument('--dir', default='.', help='Directory containing logs')
+    p.add_argument('--dir', default='.', help='Directory containing logs, or - to filter stdin')
+    p.add_argument('--recursive', '-r', action='store_true', help='Also scan logs in subdirectories')
+    p.add_argument('--include', action='append', help='Only scan files matching this glob (can repeat)')
+    p.add_argument('--exclude', action='append', help='Skip files and directories matching this glob (can repeat)')
     p.add_argument('--level', choices=LOG_LEVELS)
-    p.add_argument('--pattern', help='Search pattern (regex)')
+    p.add_argument('--pattern', action='append', help='Search pattern (regex, can repeat)')
+    p.add_argument('--patterns-file', help='File with one search pattern per line')
     p.add_argument('--export', help='File to export filtered logs')
+    p.add_argument('--export-dir', help='Directory to export matches into one file per pattern')
+    p.add_argument('--workers', type=int, help='Scan with N worker processes (default: serial)')
+    p.add_argument('--no-mmap', action='store_true', help='Disable the mmap/bytes fast path')
+    p.add_argument('--checkpoint', help='State file; only scan data appended since the last run')
+    p.add_argument('--follow', action='store_true', help='Keep running and print new matches as they are written')
+    p.add_argument('--interval', type=float, default=1.0, help='Polling interval for --follow (seconds)')
+    p.add_argument('--top-templates', type=int, metavar='K', help='Report the K most frequent message templates')
+    p.add_argument('--index', help='Trigram index (see the index command) used to narrow --pattern queries')
+    p.add_argument('--since', type=parse_when, help='Only lines at or after this time (ISO-8601 or HH:MM[:SS])')
+    p.add_argument('--until', type=parse_when, help='Only lines up to this time (ISO-8601 or HH:MM[:SS])')
+    p.add_argument('--time-format', action='append', help='strptime format of the leading timestamp (can repeat; default ISO-8601)')
+    sub = p.add_subparsers(dest='command')
+    ix = sub.add_parser('index', help='Build or update a trigram index of the logs')
+    ix.add_argument('--dir', default='.', help='Directory containing logs')
+    ix.add_argument('--index', required=True, help='Index file to create or update')
+    ix.add_argument('--workers', type=int, help='Index with N worker processes')
+    ix.add_argument('--recursive', '-r', action='store_true', help='Also index logs in subdirectories')
     args = p.parse_args()
 
-    res = analyze_logs(args.dir, level=args.level, pattern=args.pattern)
-    print('Total lines scanned:', res['total_lines'])
-    print('Counts by level:', res['level_counts'])
-    print('Matched lines:', len(res['matches']))
-    if args.export and res['matches']:
-        save_matches(res['matches'], args.export)
+    if args.command == 'index':
+        import log_index
+        n = log_index.build_index(args.dir, args.index, workers=args.workers, recursive=args.recursive)
+        print('Indexed %d new bytes into %s' % (n, args.index))
+        return
+
+    patterns = (args.pattern or []) + (load_patterns(args.patterns_file) if args.patterns_file else [])
+    args.pattern = patterns if len(patterns) > 1 else (patterns[0] if patterns else None)
+    multi = len(patterns) > 1
+
+    if args.dir == '-':
+        _stdin_main(args)
+        return
+
+    checkpoint = load_checkpoint(args.checkpoint) if args.checkpoint else None
+    if args.follow:
+        _follow_main(args, checkpoint)
+        return
+
+    stats = {}
+    found = iter_matches(args.dir, level=args.level, pattern=args.pattern, workers=args.workers,
+                         stats=stats, use_mmap=not args.no_mmap, checkpoint=checkpoint, index=args.index,
+                         since=args.since, until=args.until, time_formats=args.time_format,
+                         top_templates=args.top_templates and args.top_templates * TEMPLATE_CAPACITY_FACTOR,
+                         recursive=args.recursive, include=args.include, exclude=args.exclude)
+    by_pattern = Counter()
+    if multi and args.export_dir:
+        found = split_by_pattern(found, args.export_dir, patterns, by_pattern)
+    elif multi:
+        found = _count_hits(found, by_pattern)
+    if args.export:
+        n = save_matches(found, args.export)
+    else:
+        n = sum(1 for _ in found)
+    print('Total lines scanned:', stats['total_lines'])
+    print('Counts by level:', dict(stats['level_counts']))
+    print('Matched lines:', n)
+    if multi:
+        print('Matches by pattern:')
+        for i, pat in enumerate(patterns):
+            print('  %6d  %s' % (by_pattern[i], pat))
+        if args.export_dir:
+            print('Exported per-pattern matches to', args.export_dir)
+    if args.export and n:
         print('Exported matches to', args.export)
+    if args.top_templates:
+        _print_templates('Top templates:', stats.get('templates'), args.top_templates)
+    if checkpoint is not None:
+        save_checkpoint(checkpoint, args.checkpoint)
+        cumulative = Counter()
+        templates = None
+        for entry in checkpoint.values():
+            cumulative.update(entry['level_counts'])
+            if entry.get('templates'):
+                templates = (templates or SpaceSaving(entry['templates'].capacity)).merge(entry['templates'])
+        print('Counts by level (all runs):', dict(cumulative))
+        if args.top_templates:
+            _print_templates('Top templates (all runs):', templates, args.top_templates)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""Trigram index for log_analyzer (Day 2)
+
+Maps every 3-byte sequence (lower-cased) to the blocks of the log files that
+contain it. A --pattern query takes the literal text of the regex, reads only
+the blocks holding all of its trigrams and confirms hits with the real regex.
+Line and level totals are stored per file, so the summary stays exact.
+
+Usage:
+  python log_analyzer.py index --dir logs/ --index logs.idx
+  python log_analyzer.py --dir logs/ --pattern "connection timeout" --index logs.idx
+"""
+import concurrent.futures
+import json
+import mmap
+import os
+import sqlite3
+import stat
+from array import array
+from collections import Counter
+
+from log_analyzer import _add_stats, _count_range, _decompressor, _last_newline_end, _log_files, required_literals
+
+# newline-aligned block size; smaller blocks mean fewer bytes read per query but a larger index
+BLOCK_SIZE = 128 * 1024
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY, path TEXT UNIQUE, inode INTEGER, indexed INTEGER,
+    total_lines INTEGER, level_counts TEXT);
+CREATE TABLE IF NOT EXISTS blocks (id INTEGER PRIMARY KEY AUTOINCREMENT, file_id INTEGER, start INTEGER, end INTEGER);
+CREATE INDEX IF NOT EXISTS blocks_file ON blocks(file_id);
+CREATE TABLE IF NOT EXISTS grams (gram BLOB PRIMARY KEY, blocks BLOB);
+'''
+
+
+def _connect(index_path):
+    db = sqlite3.connect(index_path)
+    db.executescript(SCHEMA)
+    return db
+
+
+def _grams(data):
+    data = data.lower()
+    return {data[i:i + 3] for i in range(len(data) - 2)}
+
+
+def _pattern_grams(pattern):
+    grams = set()
+    for lit in required_literals(pattern):
+        grams |= _grams(lit.encode('ascii'))
+    return grams
+
+
+def _index_range(job):
+    """Worker: split bytes [start, end) of a file into blocks; returns (path, blocks, total, counts)."""
+    path, start, end = job
+    blocks = []
+    with open(path, 'rb') as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        total, counts = _count_range(buf, start, end)
+        pos = start
+        while pos < end:
+            stop = buf.find(b'\n', min(pos + BLOCK_SIZE, end), end) + 1 or end
+            blocks.append((pos, stop, _grams(buf[pos:stop])))
+            pos = stop
+    return path, blocks, total, {k.decode('ascii'): v for k, v in counts.items()}
+
+
+def _merge_postings(db, postings):
+    grams = list(postings)
+    for i in range(0, len(grams), 500):
+        chunk = grams[i:i + 500]
+        rows = db.execute('SELECT gram, blocks FROM grams WHERE gram IN (%s)' % ','.join('?' * len(chunk)), chunk)
+        for gram, blob in rows:
+            ids = array('q')
+            ids.frombytes(blob)
+            ids.extend(postings[gram])
+            postings[gram] = ids
+    db.executemany('INSERT OR REPLACE INTO grams VALUES (?, ?)', ((g, ids.tobytes()) for g, ids in postings.items()))
+
+
+def _store(db, file_id, result, indexed):
+    _, blocks, total, counts = result
+    postings = {}
+    for start, end, grams in blocks:
+        bid = db.execute('INSERT INTO blocks (file_id, start, end) VALUES (?, ?, ?)', (file_id, start, end)).lastrowid
+        for g in grams:
+            postings.setdefault(g, array('q')).append(bid)
+    _merge_postings(db, postings)
+    row = db.execute('SELECT total_lines, level_counts FROM files WHERE id = ?', (file_id,)).fetchone()
+    level_counts = Counter(json.loads(row[1]))
+    level_counts.update(counts)
+    db.execute('UPDATE files SET indexed = ?, total_lines = ?, level_counts = ? WHERE id = ?',
+               (indexed, row[0] + total, json.dumps(level_counts), file_id))
+
+
+def build_index(path, index_path, workers=None, recursive=False):
+    """Index (or update the index of) every plain log file in `path` (and below, if `recursive`).
+
+    Appended data is indexed incrementally; a file whose inode changed or that
+    shrank is reindexed from scratch. Compressed files are left to a full scan.
+    Returns the number of bytes indexed.
+    """
+    db = _connect(index_path)
+    known = {row[0]: row[1:] for row in db.execute('SELECT path, id, inode, indexed FROM files')}
+    jobs = {}
+    for f in _log_files(path, recursive):
+        key = os.path.abspath(f)
+        try:
+            st = os.stat(f)
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            with open(f, 'rb') as fh:
+                if _decompressor(fh):
+                    continue
+            file_id, inode, indexed = known.get(key, (None, None, 0))
+            if file_id is None:
+                file_id = db.execute("INSERT INTO files VALUES (NULL, ?, ?, 0, 0, '{}')", (key, st.st_ino)).lastrowid
+            elif inode != st.st_ino or st.st_size < indexed:
+                db.execute('DELETE FROM blocks WHERE file_id = ?', (file_id,))
+                db.execute("UPDATE files SET inode = ?, indexed = 0, total_lines = 0, level_counts = '{}' WHERE id = ?",
+                           (st.st_ino, file_id))
+                indexed = 0
+            end = _last_newline_end(f, indexed, st.st_size)
+        except Exception as e:
+            print('Error indexing', f, e)
+            continue
+        if end > indexed:
+            jobs[key] = (file_id, indexed, end)
+
+    todo = [(key, start, end) for key, (_, start, end) in jobs.items()]
+    if workers and workers > 1:
+        ex = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        results = ex.map(_index_range, todo)
+    else:
+        ex = None
+        results = map(_index_range, todo)
+    try:
+        for result in results:
+            file_id, _, end = jobs[result[0]]
+            _store(db, file_id, result, end)
+            db.commit()
+    finally:
+        if ex:
+            ex.shutdown()
+        db.close()
+    return sum(end - start for _, start, end in todo)
+
+
+def _candidate_blocks(db, grams):
+    candidates = None
+    for g in grams:
+        row = db.execute('SELECT blocks FROM grams WHERE gram = ?', (g,)).fetchone()
+        ids = array('q')
+        if row:
+            ids.frombytes(row[0])
+        candidates = set(ids) if candidates is None else candidates & set(ids)
+        if not candidates:
+            break
+    by_file = {}
+    ids = list(candidates or ())
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        rows = db.execute('SELECT file_id, start, end FROM blocks WHERE id IN (%s)' % ','.join('?' * len(chunk)), chunk)
+        for file_id, start, end in rows:
+            by_file.setdefault(file_id, []).append((start, end))
+    return by_file
+
+
+def _coalesce(ranges):
+    """Merge adjacent blocks so neighbouring candidates are read as one range."""
+    out = []
+    for start, end in sorted(ranges):
+        if out and out[-1][1] == start:
+            out[-1] = (out[-1][0], end)
+        else:
+            out.append((start, end))
+    return out
+
+
+def plan(index_path, files, pattern, stats):
+    """Return (path, start, end, sinks) spans for log_analyzer.iter_matches.
+
+    Indexed files contribute their stored totals to `stats` and only their
+    candidate blocks are scanned (sinks=[], so block totals are not counted
+    twice); data appended after indexing and unindexed files are scanned in
+    full. `pattern` may be a list, in which case the candidates of every
+    pattern are read. Returns None when the index is missing or a pattern
+    has no literal trigrams to look up.
+    """
+    gram_sets = [_pattern_grams(p) for p in (pattern if isinstance(pattern, (list, tuple)) else [pattern])]
+    if not all(gram_sets) or not os.path.exists(index_path):
+        return None
+    db = sqlite3.connect(index_path)
+    try:
+        rows = {r[1]: r for r in db.execute('SELECT id, path, inode, indexed, total_lines, level_counts FROM files')}
+        blocks = {}
+        for grams in gram_sets:
+            for file_id, ranges in _candidate_blocks(db, grams).items():
+                blocks.setdefault(file_id, set()).update(ranges)
+    except sqlite3.Error:
+        return None
+    finally:
+        db.close()
+
+    spans = []
+    for f in files:
+        row = rows.get(os.path.abspath(f))
+        try:
+            st = os.stat(f)
+        except OSError:
+            st = None
+        if not row or not st or row[2] != st.st_ino or st.st_size < row[3]:
+            spans.append((f, 0, None, [stats]))
+            continue
+        file_id, _, _, indexed, total, level_counts = row
+        _add_stats(stats, total, json.loads(level_counts))
+        spans.extend((f, start, end, []) for start, end in _coalesce(blocks.get(file_id, ())))
+        if st.st_size > indexed:
+            spans.append((f, indexed, None, [stats]))
+    return spans
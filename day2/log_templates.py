@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Message templates and bounded-memory top-K counting for log_analyzer (Day 2)
+
+Numbers, IDs, IPs and timestamps in a line are masked so that messages that
+differ only in those values share one template. Templates are counted with a
+Space-Saving sketch: a fixed number of counters, so memory does not grow with
+the number of distinct messages, and sketches from several workers or runs
+can be merged.
+
+Usage:
+  python log_analyzer.py --dir logs/ --level ERROR --top-templates 10
+"""
+import heapq
+import re
+
+TEMPLATE_RE = re.compile(r'''
+    (?P<TS>\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(?::\d{2}(?:[.,]\d+)?)?(?:Z|[+-]\d{2}:?\d{2})?)
+  | (?P<UUID>\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b)
+  | (?P<IP>\b\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?\b)
+  | (?P<HEX>\b0x[0-9a-f]+\b|\b(?=[0-9a-f]*\d)(?=[0-9a-f]*[a-f])[0-9a-f]{8,}\b)
+  | (?P<NUM>\d+(?:\.\d+)*)
+''', re.IGNORECASE | re.VERBOSE)
+
+
+def mask_template(line):
+    """Replace variable parts of a log line with <TS>, <UUID>, <IP>, <HEX> and <NUM>."""
+    return TEMPLATE_RE.sub(lambda m: '<%s>' % m.lastgroup, line)
+
+
+class SpaceSaving:
+    """Fixed-size heavy-hitter sketch (Metwally et al., "Space-Saving").
+
+    At most `capacity` items are tracked. A reported count over-estimates the
+    true count by at most its error, and every item seen more than
+    total/capacity times is guaranteed to be tracked.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.total = 0
+        self.counts = {}  # item -> [count, error]
+        self._heap = []   # one (count, item) entry per item; counts may be stale (too low)
+
+    def add(self, item, n=1):
+        self.total += n
+        c = self.counts.get(item)
+        if c is not None:
+            c[0] += n
+            return
+        if len(self.counts) < self.capacity:
+            self.counts[item] = [n, 0]
+            heapq.heappush(self._heap, (n, item))
+            return
+        low, victim = self._pop_min()
+        del self.counts[victim]
+        self.counts[item] = [low + n, low]
+        heapq.heappush(self._heap, (low + n, item))
+
+    def _pop_min(self):
+        while True:
+            count, item = heapq.heappop(self._heap)
+            current = self.counts[item][0]
+            if current == count:
+                return count, item
+            heapq.heappush(self._heap, (current, item))
+
+    def _floor(self):
+        """Count to assume for an untracked item: the smallest count once the sketch is full."""
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(c for c, _ in self.counts.values())
+
+    def merge(self, other):
+        """Fold another sketch into this one, keeping the over-estimate guarantee."""
+        mine, theirs = self._floor(), other._floor()
+        merged = {}
+        for item in self.counts.keys() | other.counts.keys():
+            a = self.counts.get(item, (mine, mine))
+            b = other.counts.get(item, (theirs, theirs))
+            merged[item] = [a[0] + b[0], a[1] + b[1]]
+        self.capacity = max(self.capacity, other.capacity)
+        self.counts = dict(heapq.nlargest(self.capacity, merged.items(), key=lambda kv: kv[1][0]))
+        self._heap = [(c, item) for item, (c, _) in self.counts.items()]
+        heapq.heapify(self._heap)
+        self.total += other.total
+        return self
+
+    def top(self, k):
+        """Return the k largest (item, count, error) triples."""
+        best = heapq.nlargest(k, self.counts.items(), key=lambda kv: kv[1][0])
+        return [(item, c, e) for item, (c, e) in best]
+
+    def to_dict(self):
+        return {'capacity': self.capacity, 'total': self.total,
+                'counts': [[item, c, e] for item, (c, e) in self.counts.items()]}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['capacity'])
+        sketch.total = data['total']
+        sketch.counts = {item: [c, e] for item, c, e in data['counts']}
+        sketch._heap = [(c, item) for item, c, _ in data['counts']]
+        heapq.heapify(sketch._heap)
+        return sketch
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""Tests for log_analyzer (Day 2)
+
+Run:
+  python -m pytest day2/test_log_analyzer.py
+  python day2/test_log_analyzer.py
+"""
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import discovery  # noqa: E402
+from log_analyzer import PatternSet, analyze_logs, filter_lines, iter_matches  # noqa: E402
+
+
+class LogTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, data):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as fh:
+            fh.write(data)
+        return path
+
+    def analyze(self, **kwargs):
+        """analyze_logs() on every path (mmap, text, workers); checks they agree and returns the result."""
+        res = analyze_logs(self.dir, **kwargs)
+        self.assertEqual(analyze_logs(self.dir, use_mmap=False, **kwargs), res)
+        self.assertEqual(analyze_logs(self.dir, workers=2, **kwargs), res)
+        return res
+
+
+class UnicodeFoldTest(LogTest):
+    LINES = ['2024-01-01 INFO ſtatus ok', '2024-01-01 ERROR status bad', '2024-01-01 INFO plain',
+             '2024-01-01 WARNING KEY ſtatus and status']
+
+    def test_pattern_set_hits(self):
+        ps = PatternSet(['status', 'bad', 'key'])
+        self.assertEqual(ps.hits(self.LINES[0]), [0])
+        self.assertEqual(ps.hits(self.LINES[3]), [0, 2])
+        self.assertEqual(ps.hits(self.LINES[2]), [])
+
+    def test_filter_lines(self):
+        found = list(filter_lines(self.LINES, pattern=['status', 'bad']))
+        self.assertEqual(found, [(self.LINES[0], [0]), (self.LINES[1], [0, 1]), (self.LINES[3], [0])])
+
+    def test_file_scan(self):
+        self.write('u.log', ('\n'.join(self.LINES) + '\n').encode('utf-8'))
+        res = self.analyze(pattern=['status', 'bad'])
+        self.assertEqual(res['total_lines'], 4)
+        self.assertEqual(res['matches'], [self.LINES[0], self.LINES[1], self.LINES[3]])
+        self.assertEqual(res['pattern_counts'], {'status': 3, 'bad': 1})
+        self.assertEqual(self.analyze(pattern='status')['matches'], res['matches'])
+
+
+class CrlfTest(LogTest):
+    def setUp(self):
+        super().setUp()
+        lines = ['2024-01-01 WARNING req 1 took 12 ms', '2024-01-01 WARNING req 2 took 7 ms extra',
+                 '2024-01-01 ERROR req 3 took 30 ms', '2024-01-01 WARNING req 4 took 9 ms']
+        self.write('crlf.log', ''.join(l + '\r\n' for l in lines).encode('ascii'))
+        self.lines = lines
+
+    def test_end_anchor(self):
+        res = self.analyze(level='WARNING', pattern=r'\d+ ms$')
+        self.assertEqual(res['matches'], [self.lines[0], self.lines[3]])
+        self.assertEqual(res['total_lines'], 4)
+
+    def test_end_anchor_pattern_set(self):
+        res = self.analyze(pattern=[r'\d+ ms$', 'extra$'])
+        self.assertEqual(res['pattern_counts'], {r'\d+ ms$': 3, 'extra$': 1})
+
+    def test_no_carriage_returns_in_output(self):
+        self.assertEqual(self.analyze(pattern='req')['matches'], self.lines)
+
+
+class CompressedRotationTest(LogTest):
+    def append(self, name, *lines):
+        with open(os.path.join(self.dir, name), 'a') as fh:
+            fh.writelines('2024-01-01 ERROR %s\n' % l for l in lines)
+
+    def compress(self, name, dest):
+        path = os.path.join(self.dir, name)
+        with open(path, 'rb') as src, gzip.open(os.path.join(self.dir, dest), 'wb') as out:
+            shutil.copyfileobj(src, out)
+        os.remove(path)
+
+    def scan(self, state, **kwargs):
+        stats = {}
+        found = [l.split(' ERROR ')[1] for l in iter_matches(self.dir, level='ERROR', stats=stats,
+                                                              checkpoint=state, **kwargs)]
+        return found, stats['total_lines']
+
+    def test_delaycompress(self):
+        state = {}
+        self.append('app.log', *['old %d' % i for i in range(100)])
+        self.assertEqual(len(self.scan(state)[0]), 100)
+        os.rename(os.path.join(self.dir, 'app.log'), os.path.join(self.dir, 'app.log.1'))
+        self.append('app.log', 'new 1')
+        self.assertEqual(self.scan(state), (['new 1'], 1))
+        # written to the rotated file after the last scan, then compressed
+        self.append('app.log.1', 'late')
+        self.compress('app.log.1', 'app.log.2.gz')
+        os.rename(os.path.join(self.dir, 'app.log'), os.path.join(self.dir, 'app.log.1'))
+        self.append('app.log', 'newest')
+        self.assertEqual(self.scan(state, workers=2), (['late', 'newest'], 2))
+        self.assertEqual(self.scan(state), ([], 0))
+        self.assertEqual(sum(e['total_lines'] for e in state.values()), 103)
+
+    def test_compress_without_delay(self):
+        state = {}
+        self.append('app.log', 'a', 'b')
+        self.scan(state)
+        self.compress('app.log', 'app.log.1.gz')
+        self.append('app.log', 'c')
+        self.assertEqual(self.scan(state), (['c'], 1))
+
+    def test_unrelated_archive_is_scanned(self):
+        state = {}
+        self.append('app.log', 'a')
+        self.scan(state)
+        self.append('other.log', 'x')
+        self.compress('other.log', 'other.log.1.gz')
+        self.assertEqual(self.scan(state), (['x'], 1))
+
+
+class DiscoveryTest(LogTest):
+    def test_threaded_walk_reads_ahead_a_bounded_number_of_dirs(self):
+        for i in range(30):
+            for j in range(10):
+                os.makedirs(os.path.join(self.dir, 'd%02d' % i, 's%d' % j))
+                self.write('d%02d/s%d/app.log' % (i, j), b'x\n')
+        serial = list(discovery.iter_dirs(self.dir))
+        listed = []
+        real = discovery._list_dir
+
+        def counting(path, rel, exclude):
+            listed.append(path)
+            return real(path, rel, exclude)
+
+        discovery._list_dir = counting
+        try:
+            walk = discovery.iter_dirs(self.dir, workers=2)
+            found = []
+            for item in walk:
+                found.append(item)
+                if len(found) == 5:
+                    break
+            walk.close()
+        finally:
+            discovery._list_dir = real
+        self.assertEqual(found, serial[:5])
+        # 1 root + the dirs consumed, plus at most READ_AHEAD per worker
+        self.assertLessEqual(len(listed), 1 + 6 + discovery.READ_AHEAD * 2)
+        self.assertEqual(list(discovery.iter_dirs(self.dir, workers=3)), serial)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,31 +1,519 @@
 #!/usr/bin/env python3
 """Service Health Check Tool (Day 3)
 
+Endpoints are checked concurrently by a bounded thread pool on top of
+http.client: at most --concurrency requests in flight overall and
+--per-host per host. Each host keeps a pool of keep-alive connections and
+DNS answers are cached, so a sweep takes about as long as its slowest
+endpoint. Retries wait on a timer heap instead of in a worker, and endpoints
+that keep failing are skipped by a circuit breaker. --watch keeps
+re-checking and writes rolling latency percentiles as JSON lines.
+
 Usage:
   python health_check.py --endpoints https://example.com/health https://httpbin.org/status/200
   python health_check.py --file endpoints.txt
+  python health_check.py --file endpoints.txt --concurrency 64 --per-host 8
+  python health_check.py --file endpoints.txt --watch 15 --window 300 >> latency.jsonl
+  python health_check.py --file endpoints.txt --state breakers.json   # from cron
 """
 import argparse
+import concurrent.futures
+import datetime
+import heapq
+import http.client
+import itertools
 import json
+import os
+import queue
+import random
+import socket
+import ssl
+import sys
+import threading
 import time
-import urllib.request
-import urllib.error
+import urllib.parse
+from collections import Counter, deque
 
+from latency import LogHistogram, RollingWindow
 
-def check_url(url, timeout=3, retries=2, backoff=1.5):
-    attempt = 0
-    while True:
+HEADERS = {'User-Agent': 'health-check/1.0'}
+REDIRECTS = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 10  # same limit as urllib
+LATENCY_METRICS = ('connect', 'ttfb', 'total')
+PERCENTILES = (('p50', 50), ('p90', 90), ('p99', 99), ('max', 100))
+
+
+def _open_socket(addrs, port, timeout):
+    """Connect to the first reachable address of a cached DNS answer."""
+    err = None
+    for host in addrs:
+        try:
+            sock = socket.create_connection((host, port), timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return sock
+        except OSError as e:
+            err = e
+    raise err or OSError('no addresses for host')
+
+
+class _HTTPConnection(http.client.HTTPConnection):
+    def __init__(self, host, port, timeout, resolve):
+        super().__init__(host, port, timeout=timeout)
+        self._resolve = resolve
+
+    def connect(self):
+        self.sock = _open_socket(self._resolve(self.host, self.port), self.port, self.timeout)
+
+
+class _HTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, host, port, timeout, resolve, context):
+        super().__init__(host, port, timeout=timeout, context=context)
+        self._resolve = resolve
+
+    def connect(self):
+        sock = _open_socket(self._resolve(self.host, self.port), self.port, self.timeout)
+        self.sock = self._context.wrap_socket(sock, server_hostname=self.host)
+
+
+class _Timers:
+    """Runs callbacks at given times from one thread, off a heap of deadlines."""
+
+    def __init__(self):
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def call_later(self, delay, fn, *args):
+        with self._cond:
+            if self._closed:
+                return
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), fn, args))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._closed and (not self._heap or self._heap[0][0] > time.monotonic()):
+                    self._cond.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                if self._closed:
+                    return
+                _, _, fn, args = heapq.heappop(self._heap)
+            try:
+                fn(*args)
+            except Exception as e:
+                print('Error in timer callback', e)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+
+class HostPool:
+    """Idle keep-alive connections to one scheme://host:port (LIFO, at most `size` kept)."""
+
+    def __init__(self, factory, size):
+        self.factory = factory
+        self.size = size
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def get(self):
+        """Return (connection, reused)."""
+        with self.lock:
+            if self.idle:
+                return self.idle.pop(), True
+        return self.factory(), False
+
+    def put(self, conn):
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close()
+
+
+def _host_key(url):
+    try:
+        parts = urllib.parse.urlsplit(url)
+        scheme = parts.scheme.lower()
+        return scheme, parts.hostname, parts.port or (443 if scheme == 'https' else 80)
+    except ValueError:
+        return url
+
+
+class Checker:
+    """Concurrent health checker with per-host connection pools, a DNS cache,
+    retries on a timer heap and a circuit breaker per endpoint."""
+
+    def __init__(self, timeout=3, retries=2, backoff=1.5, concurrency=32, per_host=4, dns_ttl=300,
+                 breaker_failures=1, breaker_cooldown=30):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.dns_ttl = dns_ttl
+        self._dns = {}
+        self._pools = {}
+        self._lock = threading.Lock()
+        self._ex = None
+        self._active = Counter()  # host key -> checks running
+        self._waiting = {}  # host key -> deque of jobs over the per-host limit
+        self._timers = _Timers()
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown = breaker_cooldown
+        self.breakers = {}  # url -> CircuitBreaker
+        self._context = ssl.create_default_context()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._timers.close()
+        with self._lock:
+            ex, self._ex = self._ex, None
+        if ex is not None:
+            ex.shutdown(cancel_futures=True)
+        with self._lock:
+            pools, self._pools = list(self._pools.values()), {}
+        for pool in pools:
+            pool.close()
+
+    def _resolve(self, host, port):
+        """Addresses for `host`, cached for `dns_ttl` seconds."""
+        now = time.monotonic()
+        hit = self._dns.get((host, port))
+        if hit and hit[0] > now:
+            return hit[1]
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        addrs = list(dict.fromkeys(info[4][0] for info in infos))
+        self._dns[(host, port)] = (now + self.dns_ttl, addrs)
+        return addrs
+
+    def _pool(self, key):
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                scheme, host, port = key
+                if scheme == 'https':
+                    factory = lambda: _HTTPSConnection(host, port, self.timeout, self._resolve, self._context)
+                else:
+                    factory = lambda: _HTTPConnection(host, port, self.timeout, self._resolve)
+                pool = self._pools[key] = HostPool(factory, self.per_host)
+            return pool
+
+    def _get(self, url, timings):
+        """One GET over a pooled connection; returns (status, location).
+
+        The time spent opening new connections is added to timings['connect'].
+        """
+        key = _host_key(url)
+        if not isinstance(key, tuple) or key[0] not in ('http', 'https') or not key[1]:
+            raise ValueError('unsupported URL: %s' % url)
+        parts = urllib.parse.urlsplit(url)
+        target = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+        pool = self._pool(key)
+        while True:
+            conn, reused = pool.get()
+            try:
+                if conn.sock is None:
+                    t0 = time.perf_counter()
+                    conn.connect()
+                    timings['connect'] = (timings['connect'] or 0) + time.perf_counter() - t0
+                conn.request('GET', target, headers=HEADERS)
+                resp = conn.getresponse()
+                timings['ttfb'] = time.perf_counter()
+                resp.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                if reused:
+                    continue  # the server closed an idle keep-alive connection; not a failure
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            if resp.will_close:
+                conn.close()
+            else:
+                pool.put(conn)
+            return resp.status, resp.getheader('Location')
+
+    def fetch(self, url):
+        """GET `url`, following redirects like urllib; returns (ok, status, timings).
+
+        timings has 'connect' (None when only kept-alive connections were used),
+        'ttfb' (until the final response's headers) and 'total', in seconds.
+        """
+        start = time.perf_counter()
+        timings = {'connect': None, 'ttfb': None}
+        for _ in range(MAX_REDIRECTS + 1):
+            status, location = self._get(url, timings)
+            if status not in REDIRECTS or not location:
+                break
+            url = urllib.parse.urljoin(url, location)
+        timings['ttfb'] -= start
+        timings['total'] = time.perf_counter() - start
+        ok = status < 400 and status not in REDIRECTS
+        return ok, status, timings
+
+    def measure(self, url):
+        """Check one endpoint through the pool; returns (ok, status or error, timings or None)."""
+        done = queue.Queue()
+        self.submit(url, lambda *result: done.put(result))
+        return done.get()[1:]
+
+    def check(self, url):
+        """Like measure(), without the timings: (ok, status or error)."""
+        return self.measure(url)[:2]
+
+    def breaker(self, url):
+        with self._lock:
+            b = self.breakers.get(url)
+            if b is None:
+                b = self.breakers[url] = CircuitBreaker(self.breaker_failures, self.breaker_cooldown)
+            return b
+
+    def submit(self, url, callback):
+        """Check `url` in the worker pool; calls callback(url, ok, status, timings) once it is done.
+
+        Connection errors are retried up to `retries` times with exponential
+        backoff. An endpoint whose circuit is open is not contacted at all, and
+        a half-open one gets a single probe without retries.
+        """
+        mode = self.breaker(url).allow()
+        if mode is None:
+            callback(url, False, 'circuit open: %s' % self.breaker(url).last_error, None)
+            return
+        self._dispatch(_host_key(url), (url, callback, 0, 0 if mode == 'probe' else self.retries))
+
+    def _dispatch(self, key, job):
+        """Run `job` in the pool; at most `per_host` jobs of one host run at once and the
+        rest wait in a per-host queue, so they never hold one of the `concurrency` threads."""
+        with self._lock:
+            if self._ex is None:
+                self._ex = concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency)
+            if self._active[key] >= self.per_host:
+                self._waiting.setdefault(key, deque()).append(job)
+                return
+            self._active[key] += 1
+        self._ex.submit(self._run, key, job)
+
+    def _run(self, key, job):
+        url, callback, attempt, retries = job
+        result = None
         try:
-            req = urllib.request.Request(url, headers={'User-Agent': 'health-check/1.0'})
-            with urllib.request.urlopen(req, timeout=timeout) as r:
-                return True, r.status
-        except urllib.error.HTTPError as e:
-            return False, e.code
+            result = self.fetch(url)
+            self.breaker(url).success()
         except Exception as e:
-            attempt += 1
-            if attempt > retries:
-                return False, str(e)
-            time.sleep(backoff ** attempt)
+            if attempt < retries:
+                # wait on the timer heap, not in this worker
+                self._timers.call_later(self.backoff ** (attempt + 1), self._dispatch, key,
+                                        (url, callback, attempt + 1, retries))
+            else:
+                result = (False, str(e), None)
+                self.breaker(url).failure(str(e))
+        finally:
+            with self._lock:
+                waiting = self._waiting.get(key)
+                following = waiting.popleft() if waiting else None
+                if not waiting:
+                    self._waiting.pop(key, None)
+                if following is None:
+                    self._active[key] -= 1
+                    if not self._active[key]:
+                        del self._active[key]
+            if following is not None:
+                self._ex.submit(self._run, key, following)
+        if result is not None:
+            callback(url, *result)
+
+    def sweep(self, urls, on_result=None):
+        """Check all `urls` concurrently; returns {url: (ok, status)} in input order.
+
+        `on_result(url, ok, status, timings)` is called as each result arrives.
+        """
+        done = queue.Queue()
+        unique = list(dict.fromkeys(urls))
+        for u in unique:
+            self.submit(u, lambda *result: done.put(result))
+        results = {}
+        for _ in unique:
+            u, ok, status, timings = done.get()
+            results[u] = (ok, status)
+            if on_result:
+                on_result(u, ok, status, timings)
+        return {u: results[u] for u in urls}
+
+
+class CircuitBreaker:
+    """Per-endpoint circuit breaker.
+
+    closed: checks run normally. After `failures` failed checks in a row
+    (connection errors after all retries; HTTP error statuses are answers and
+    do not count) it opens. open: the endpoint is not contacted until
+    `cooldown` seconds have passed. half-open: one probe without retries; a
+    success closes the circuit, a failure opens it again for twice as long
+    (up to `max_cooldown`).
+    """
+
+    def __init__(self, failures=1, cooldown=30, max_cooldown=600):
+        self.failures = failures
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.state = 'closed'
+        self.failed = 0
+        self.cooldown = cooldown
+        self.opened_at = 0
+        self.last_error = None
+
+    def allow(self):
+        """'check' (full retries), 'probe' (a single attempt) or None (skip)."""
+        if self.state == 'closed':
+            return 'check'
+        if self.state == 'open' and time.time() < self.opened_at + self.cooldown:
+            return None
+        self.state = 'half-open'
+        return 'probe'
+
+    def success(self):
+        self.state = 'closed'
+        self.failed = 0
+        self.cooldown = self.base_cooldown
+
+    def failure(self, error):
+        self.last_error = error
+        self.failed += 1
+        if self.state == 'half-open':
+            self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+        elif self.failed < self.failures:
+            return
+        self.state = 'open'
+        self.opened_at = time.time()
+
+    def to_dict(self):
+        return {k: getattr(self, k) for k in ('state', 'failed', 'cooldown', 'opened_at', 'last_error')}
+
+    @classmethod
+    def from_dict(cls, data, failures=1, cooldown=30):
+        b = cls(failures, cooldown)
+        for k, v in data.items():
+            setattr(b, k, v)
+        return b
+
+
+def load_breakers(path, failures=1, cooldown=30):
+    """Circuit states saved by save_breakers(); a missing or corrupt file gives {}."""
+    try:
+        with open(path) as fh:
+            data = json.load(fh)
+    except (OSError, ValueError):
+        return {}
+    return {url: CircuitBreaker.from_dict(d, failures, cooldown) for url, d in data.items()}
+
+
+def save_breakers(breakers, path):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as fh:
+        json.dump({url: b.to_dict() for url, b in breakers.items()}, fh)
+    os.replace(tmp, path)
+
+
+class _WatchSlot:
+    """Checks, errors and latency histograms (microseconds) of one sub-window."""
+
+    def __init__(self):
+        self.checks = 0
+        self.errors = 0
+        self.latency = {m: LogHistogram() for m in LATENCY_METRICS}
+
+
+class EndpointStats:
+    """Rolling latency statistics of one endpoint; memory stays fixed however long it runs."""
+
+    def __init__(self, window):
+        self.window = window
+        self.slots = RollingWindow(window, _WatchSlot)
+        self.last = None
+
+    def record(self, ok, status, timings):
+        slot = self.slots.current()
+        slot.checks += 1
+        self.last = (ok, status)
+        if not ok:
+            slot.errors += 1
+        for m in LATENCY_METRICS:
+            if timings and timings[m] is not None:
+                slot.latency[m].record(timings[m] * 1e6)
+
+    def report(self, url, circuit=None):
+        slots = self.slots.live()
+        line = {'time': datetime.datetime.now().isoformat(timespec='seconds'), 'url': url,
+                'window_s': self.window, 'checks': sum(s.checks for s in slots),
+                'errors': sum(s.errors for s in slots),
+                'ok': self.last and self.last[0], 'status': self.last and self.last[1], 'circuit': circuit}
+        for m in LATENCY_METRICS:
+            h = LogHistogram()
+            for s in slots:
+                h.merge(s.latency[m])
+            line[m + '_ms'] = {name: round(h.percentile(q) / 1000.0, 3)
+                               for name, q in PERCENTILES} if h.count else None
+        return line
+
+
+def watch(checker, urls, interval, jitter=0.1, window=60, report_every=10, out=sys.stdout):
+    """Re-check `urls` forever, each about every `interval` seconds (+/- `jitter` as a fraction).
+
+    Every `report_every` seconds one JSON line per endpoint is written to
+    `out` with connect/TTFB/total percentiles over the last `window` seconds.
+    An endpoint's next check is scheduled when its previous one finishes, so
+    checks of one endpoint never overlap.
+    """
+    stats = {u: EndpointStats(window) for u in dict.fromkeys(urls)}
+    now = time.monotonic()
+    due = [(now + random.uniform(0, interval), u) for u in stats]  # spread the first round
+    heapq.heapify(due)
+    done = queue.Queue()
+    next_report = now + report_every
+    while True:
+        now = time.monotonic()
+        while due and due[0][0] <= now:
+            checker.submit(heapq.heappop(due)[1], lambda *result: done.put(result))
+        wake = min(due[0][0] if due else next_report, next_report)
+        try:
+            u, ok, status, timings = done.get(timeout=max(0, wake - now))
+        except queue.Empty:
+            pass
+        else:
+            stats[u].record(ok, status, timings)
+            delay = interval * random.uniform(1 - jitter, 1 + jitter)
+            heapq.heappush(due, (time.monotonic() + delay, u))
+        if time.monotonic() >= next_report:
+            for u, st in stats.items():
+                out.write(json.dumps(st.report(u, checker.breaker(u).state)) + '\n')
+            out.flush()
+            next_report += report_every
+
+
+def check_url(url, timeout=3, retries=2, backoff=1.5):
+    with Checker(timeout, retries, backoff) as checker:
+        return checker.check(url)
 
 
 def load_endpoints_from_file(path):
@@ -37,6 +525,17 @@ def main():
     p = argparse.ArgumentParser()
     p.add_argument('--endpoints', nargs='*', help='List of endpoints to check')
     p.add_argument('--file', help='File containing endpoints (one per line)')
+    p.add_argument('--timeout', type=float, default=3, help='Per-request timeout in seconds')
+    p.add_argument('--retries', type=int, default=2, help='Retries after a connection error')
+    p.add_argument('--concurrency', type=int, default=32, help='Requests in flight at once')
+    p.add_argument('--per-host', type=int, default=4, help='Requests in flight per host (and idle connections kept)')
+    p.add_argument('--breaker-failures', type=int, default=1, help='Failed checks in a row that open an endpoint\'s circuit')
+    p.add_argument('--breaker-cooldown', type=float, default=30, help='Seconds an open circuit waits before one probe')
+    p.add_argument('--state', help='File keeping circuit breaker state between runs')
+    p.add_argument('--watch', type=float, metavar='INTERVAL', help='Keep re-checking every INTERVAL seconds and report latency')
+    p.add_argument('--jitter', type=float, default=0.1, help='Random spread of --watch intervals (fraction, default 0.1)')
+    p.add_argument('--window', type=float, default=60, help='Rolling window of --watch percentiles in seconds')
+    p.add_argument('--report', type=float, default=10, help='Seconds between --watch JSON reports')
     args = p.parse_args()
 
     urls = args.endpoints or []
@@ -47,12 +546,28 @@ def main():
         p.print_help()
         return
 
-    results = {}
-    for u in urls:
-        ok, code = check_url(u)
-        results[u] = {'ok': ok, 'status': code}
+    checker = Checker(args.timeout, args.retries, concurrency=args.concurrency, per_host=args.per_host,
+                      breaker_failures=args.breaker_failures, breaker_cooldown=args.breaker_cooldown)
+    if args.state:
+        checker.breakers.update(load_breakers(args.state, args.breaker_failures, args.breaker_cooldown))
+
+    def report(u, ok, code, timings):
         print(u, '->', 'UP' if ok else 'DOWN', code)
 
+    try:
+        if args.watch:
+            try:
+                watch(checker, urls, args.watch, args.jitter, args.window, args.report)
+            except KeyboardInterrupt:
+                pass
+            return
+        checked = checker.sweep(urls, on_result=report)
+    finally:
+        checker.close()
+        if args.state:
+            save_breakers(checker.breakers, args.state)
+    results = {u: {'ok': ok, 'status': code} for u, (ok, code) in checked.items()}
+
     print('\nSummary:')
     print(json.dumps(results, indent=2))
 
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""Fixed-memory latency histograms for health_check --watch (Day 3)
+
+LogHistogram keeps HDR-style log-linear buckets: every power of two is
+split into 2**precision sub-buckets, so a percentile read from it is within
+about 1/2**precision (3% at the default precision of 5) of the true value,
+and the number of buckets is bounded by the value range however many
+samples are recorded. RollingWindow keeps the last few minutes of such data
+as a ring of sub-windows.
+"""
+import math
+import time
+
+
+class LogHistogram:
+    """Streaming histogram of non-negative integers (e.g. microseconds)."""
+
+    def __init__(self, precision=5, highest=3600 * 10**6):
+        self.precision = precision
+        self.sub = 1 << precision
+        self.highest = highest
+        self.counts = {}  # bucket index -> count
+        self.count = 0
+        self.max = 0
+
+    def _index(self, v):
+        if v < 2 * self.sub:
+            return v
+        shift = v.bit_length() - self.precision - 1
+        return (shift + 1) * self.sub + (v >> shift) - self.sub
+
+    def _upper(self, idx):
+        """Largest value that falls into bucket `idx`."""
+        if idx < 2 * self.sub:
+            return idx
+        shift = idx // self.sub - 1
+        return ((idx % self.sub + self.sub + 1) << shift) - 1
+
+    def record(self, value):
+        v = min(max(int(value), 0), self.highest)
+        idx = self._index(v)
+        self.counts[idx] = self.counts.get(idx, 0) + 1
+        self.count += 1
+        if v > self.max:
+            self.max = v
+
+    def merge(self, other):
+        for idx, n in other.counts.items():
+            self.counts[idx] = self.counts.get(idx, 0) + n
+        self.count += other.count
+        self.max = max(self.max, other.max)
+        return self
+
+    def percentile(self, q):
+        """Value at or below which `q` percent of the samples fall (None when empty)."""
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(q / 100.0 * self.count))
+        seen = 0
+        for idx in sorted(self.counts):
+            seen += self.counts[idx]
+            if seen >= rank:
+                return min(self._upper(idx), self.max)
+        return self.max
+
+
+class RollingWindow:
+    """The last `window` seconds of data as a ring of `slots` objects made by `factory`.
+
+    current() returns the object for the present sub-window; live() returns
+    the ones still inside the window. Expired sub-windows are reused, so
+    memory stays fixed.
+    """
+
+    def __init__(self, window, factory, slots=6, clock=time.monotonic):
+        self.width = float(window) / slots
+        self.factory = factory
+        self.clock = clock
+        self.ring = [None] * slots  # (sub-window number, object)
+
+    def _now(self):
+        return int(self.clock() // self.width)
+
+    def current(self):
+        n = self._now()
+        i = n % len(self.ring)
+        if self.ring[i] is None or self.ring[i][0] != n:
+            self.ring[i] = (n, self.factory())
+        return self.ring[i][1]
+
+    def live(self):
+        n = self._now()
+        return [obj for k, obj in filter(None, self.ring) if n - k < len(self.ring)]
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""Tests for health_check against a local stand-in HTTP server (Day 3)
+
+Run:
+  python -m pytest day3/test_health_check.py
+  python day3/test_health_check.py
+"""
+import http.server
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from health_check import Checker  # noqa: E402
+
+SLOW = 0.3
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+            self.server.sockets.append(self.connection)
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, code, headers=()):
+        self.send_response(code)
+        for k, v in headers:
+            self.send_header(k, v)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def do_GET(self):
+        srv = self.server
+        with srv.lock:
+            srv.in_flight += 1
+            srv.max_in_flight = max(srv.max_in_flight, srv.in_flight)
+            srv.requests += 1
+        try:
+            if self.path.startswith('/slow'):
+                time.sleep(SLOW)
+            if self.path.startswith('/redirect'):
+                self._reply(302, [('Location', '/ok')])
+            elif self.path.startswith('/err'):
+                self._reply(500)
+            else:
+                self._reply(200)
+        finally:
+            with srv.lock:
+                srv.in_flight -= 1
+
+
+class _Server(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.lock = threading.Lock()
+        self.connections = self.requests = self.in_flight = self.max_in_flight = 0
+        self.sockets = []
+
+    def drop_connections(self):
+        """Close every open connection from the server side, like an idle keep-alive timeout."""
+        with self.lock:
+            socks, self.sockets = self.sockets, []
+        for s in socks:
+            try:
+                s.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class HealthCheckTest(unittest.TestCase):
+    def setUp(self):
+        self.server = _Server()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base = 'http://127.0.0.1:%d' % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def url(self, path):
+        return self.base + path
+
+    def test_sweep_is_concurrent(self):
+        urls = [self.url('/slow?%d' % i) for i in range(8)]
+        with Checker(timeout=5, per_host=8) as checker:
+            t0 = time.monotonic()
+            results = checker.sweep(urls)
+            elapsed = time.monotonic() - t0
+        self.assertEqual(results, {u: (True, 200) for u in urls})
+        self.assertLess(elapsed, SLOW * 3)  # serial would take 8 * SLOW
+
+    def test_per_host_limit(self):
+        urls = [self.url('/slow?%d' % i) for i in range(6)]
+        with Checker(timeout=5, concurrency=16, per_host=2) as checker:
+            t0 = time.monotonic()
+            checker.sweep(urls)
+            elapsed = time.monotonic() - t0
+        self.assertEqual(self.server.max_in_flight, 2)
+        self.assertGreaterEqual(elapsed, SLOW * 3 - 0.05)
+
+    def test_keep_alive_reuse(self):
+        with Checker(timeout=5) as checker:
+            for _ in range(5):
+                ok, status, timings = checker.measure(self.url('/ok'))
+                self.assertEqual((ok, status), (True, 200))
+            self.assertIsNone(timings['connect'])  # the last check reused the connection
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(self.server.requests, 5)
+
+    def test_stale_reused_connection_is_retried(self):
+        with Checker(timeout=5, retries=0) as checker:
+            self.assertEqual(checker.check(self.url('/ok')), (True, 200))
+            self.server.drop_connections()
+            time.sleep(0.05)
+            # retries=0: the reconnect must come from the stale-connection path, not a retry
+            self.assertEqual(checker.check(self.url('/ok')), (True, 200))
+            self.assertEqual(checker.breaker(self.url('/ok')).state, 'closed')
+        self.assertEqual(self.server.connections, 2)
+
+    def test_redirect_is_followed(self):
+        with Checker(timeout=5) as checker:
+            ok, status, timings = checker.measure(self.url('/redirect'))
+        self.assertEqual((ok, status), (True, 200))
+        self.assertEqual(self.server.requests, 2)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_http_error_status(self):
+        with Checker(timeout=5) as checker:
+            self.assertEqual(checker.check(self.url('/err')), (False, 500))
+
+    def test_cli_json_summary(self):
+        urls = [self.url('/ok'), self.url('/redirect'), self.url('/err')]
+        out = subprocess.run([sys.executable, os.path.join(HERE, 'health_check.py'), '--endpoints'] + urls,
+                             capture_output=True, text=True, timeout=30).stdout
+        summary = json.loads(out.split('Summary:\n', 1)[1])
+        self.assertEqual(summary, {
+            urls[0]: {'ok': True, 'status': 200},
+            urls[1]: {'ok': True, 'status': 200},
+            urls[2]: {'ok': False, 'status': 500},
+        })
+        self.assertEqual(list(summary), urls)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,74 +3,641 @@
 
 Features (minimal):
 - Run multiple shell commands sequentially or in parallel
-- Capture stdout/stderr and exit codes
+- Run a pipeline of steps with dependencies (critical path first)
+- Parallelism sized from the CPU quota, optionally adapted to load
+- Optional cache that skips steps whose inputs did not change
+- Per-step CPU/memory/IO accounting and a Chrome trace timeline
+- Capture stdout/stderr and exit codes (bounded: head and tail of each stream)
+- Optional live, prefixed output and full per-command log files
 - Per-command timeout
 - Graceful shutdown on SIGINT/SIGTERM
 
 Usage:
   python deploy_monitor.py --cmd "sleep 1 && echo ok" --cmd "echo hello" --parallel
+  python deploy_monitor.py --cmd "make build" --cmd "make test" --live --log-dir logs/
+  python deploy_monitor.py --pipeline pipeline.json --workers 4
+  python deploy_monitor.py --pipeline pipeline.json --adaptive
+  python deploy_monitor.py --pipeline pipeline.json --cache .step-cache
+  python deploy_monitor.py --pipeline pipeline.json --trace trace.json
 """
 import argparse
 import concurrent.futures
+import heapq
+import json
+import os
+import selectors
 import shlex
 import signal
 import subprocess
+import sys
 import threading
 import time
 
 shutdown_flag = threading.Event()
+console_lock = threading.Lock()
+# process groups of the commands running now; the signal handler forwards signals to them
+running_groups = set()
+running_lock = threading.RLock()  # re-entrant: the signal handler may interrupt a holder
 
+# bytes of each stream kept in memory at the start and at the end
+KEEP_BYTES = 8192
+READ_SIZE = 65536
+# live output without a newline is printed once this much has piled up
+LIVE_LINE = 65536
 
-def _run_command(cmd, timeout=None):
+
+class _Capture:
+    """One output stream of a command, read incrementally.
+
+    The first and last `keep` bytes stay in memory; everything goes to `log`
+    (a binary file) if given and, with a `prefix`, to the console line by line.
+    """
+
+    def __init__(self, keep, log=None, prefix=None, console=None):
+        self.keep = keep
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.size = 0
+        self.log = log
+        self.prefix = prefix
+        self.console = console
+        self.partial = bytearray()
+
+    def feed(self, data):
+        self.size += len(data)
+        if self.log:
+            self.log.write(data)
+        if self.prefix is not None:
+            self._echo(data)
+        room = self.keep - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if data:
+            self.tail += data
+            if len(self.tail) > 2 * self.keep:
+                del self.tail[:-self.keep]
+
+    def _echo(self, data):
+        end = data.rfind(b'\n')
+        if end < 0:
+            self.partial += data
+        else:
+            lines = data[:end].split(b'\n')
+            lines[0] = bytes(self.partial) + lines[0]
+            self.partial = bytearray(data[end + 1:])
+            self._write(lines)
+        if len(self.partial) > LIVE_LINE:
+            # progress bars ('\r') or binary output: print what is there rather than hold it
+            self._write([bytes(self.partial)])
+            self.partial = bytearray()
+
+    def close(self):
+        if self.prefix is not None and self.partial:
+            self._write([bytes(self.partial)])
+            self.partial = bytearray()
+
+    def _write(self, lines):
+        out = ''.join('%s %s\n' % (self.prefix, l.decode('utf-8', 'replace')) for l in lines)
+        with console_lock:
+            self.console.write(out)
+            self.console.flush()
+
+    def text(self):
+        tail = bytes(self.tail[-self.keep:])
+        omitted = self.size - len(self.head) - len(tail)
+        out = self.head.decode('utf-8', 'replace')
+        if omitted > 0:
+            out += '\n... [%d bytes omitted] ...\n' % omitted
+        return (out + tail.decode('utf-8', 'replace')).strip()
+
+
+def _open_logs(log_dir, name):
+    if not log_dir:
+        return None, None
+    os.makedirs(log_dir, exist_ok=True)
+    base = os.path.join(log_dir, name)
+    return open(base + '.out.log', 'wb', buffering=READ_SIZE), open(base + '.err.log', 'wb', buffering=READ_SIZE)
+
+
+def _run_command(cmd, timeout=None, name=None, live=False, log_dir=None, keep=KEEP_BYTES):
+    """Run `cmd` in a shell, reading its output as it is produced.
+
+    Only `keep` bytes from the start and end of stdout/stderr are kept for the
+    result; with `log_dir` the full streams go to <name>.out.log/<name>.err.log,
+    and with `live` lines are echoed as "[name] ..." while the command runs.
+    On timeout the whole process group is killed.
+    """
     if shutdown_flag.is_set():
         return {'cmd': cmd, 'status': 'skipped'}
+    name = name or 'cmd'
+    logs = (None, None)
     try:
-        proc = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=timeout)
-        return {'cmd': cmd, 'returncode': proc.returncode, 'stdout': proc.stdout.strip(), 'stderr': proc.stderr.strip()}
-    except subprocess.TimeoutExpired:
-        return {'cmd': cmd, 'status': 'timeout'}
+        logs = _open_logs(log_dir, name)
+        prefix = '[%s]' % name if live else None
+        out = _Capture(keep, logs[0], prefix, sys.stdout)
+        err = _Capture(keep, logs[1], prefix, sys.stderr)
+        started = time.time()
+        deadline = time.monotonic() + timeout if timeout else None
+        proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                start_new_session=True)
+        with running_lock:
+            running_groups.add(proc.pid)
+        if shutdown_flag.is_set():  # the signal came while the command was starting
+            _kill_group(proc, signal.SIGINT)
+        try:
+            timed_out = not _pump(proc, {proc.stdout: out, proc.stderr: err}, deadline)
+            returncode, usage, reaped = _wait_usage(proc, deadline)
+            timed_out = timed_out or not reaped
+        finally:
+            with running_lock:
+                running_groups.discard(proc.pid)
+        ended = time.time()
+        out.close()
+        err.close()
     except Exception as e:
         return {'cmd': cmd, 'status': 'error', 'error': str(e)}
+    finally:
+        for fh in logs:
+            if fh:
+                fh.close()
+    res = {'cmd': cmd, 'returncode': returncode, 'stdout': out.text(), 'stderr': err.text()}
+    if timed_out:
+        res = {'cmd': cmd, 'status': 'timeout', 'stdout': out.text(), 'stderr': err.text()}
+    if log_dir:
+        res['logs'] = [fh.name for fh in logs]
+    res.update(start=started, end=ended, rusage=usage)
+    return res
+
+
+def _wait_usage(proc, deadline=None):
+    """Reap `proc` with os.wait4; returns (returncode, rusage dict, in time).
+
+    The rusage covers the shell and every descendant it waited for. If the
+    process is still running at `deadline` (a time.monotonic() value) its
+    group is killed and `in time` is False.
+    """
+    in_time = True
+    try:
+        delay = 0.001
+        while deadline is not None:
+            pid, status, ru = os.wait4(proc.pid, os.WNOHANG)
+            if pid:
+                break
+            left = deadline - time.monotonic()
+            if left <= 0:
+                _kill_group(proc)
+                in_time = False
+                deadline = None
+            else:
+                time.sleep(min(delay, left))
+                delay = min(delay * 2, 0.05)
+        else:
+            _, status, ru = os.wait4(proc.pid, 0)
+    except (AttributeError, ChildProcessError):
+        if deadline is None:
+            return proc.wait(), None, in_time
+        try:
+            return proc.wait(max(0, deadline - time.monotonic())), None, True
+        except subprocess.TimeoutExpired:
+            _kill_group(proc)
+            return proc.wait(), None, False
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return proc.returncode, {
+        'user': ru.ru_utime, 'sys': ru.ru_stime,
+        'maxrss_kb': ru.ru_maxrss if sys.platform != 'darwin' else ru.ru_maxrss // 1024,
+        'inblock': ru.ru_inblock, 'oublock': ru.ru_oublock,
+        'nvcsw': ru.ru_nvcsw, 'nivcsw': ru.ru_nivcsw,
+    }, in_time
+
+
+def _run_step(spec, name, timeout=None, live=False, log_dir=None, keep=KEEP_BYTES, cache=None):
+    """Run a pipeline step, or replay its stored result when `cache` (a StepCache)
+    has a successful run with the same command, `inputs` and `env`."""
+    cmd = spec['cmd']
+    timeout = spec.get('timeout', timeout)
+    if cache is None or not (spec.get('inputs') or spec.get('env')):
+        return _run_command(cmd, timeout, name, live, log_dir, keep)
+    try:
+        key = cache.key(cmd, spec.get('inputs') or [], spec.get('env') or [])
+    except OSError as e:
+        print('Error hashing inputs of', name, e)
+        return _run_command(cmd, timeout, name, live, log_dir, keep)
+    res = cache.get(key)
+    if res is not None:
+        if live and res.get('stdout'):
+            _Capture(keep, prefix='[%s]' % name, console=sys.stdout).feed(res['stdout'].encode() + b'\n')
+        return dict(res, cached=True)
+    res = _run_command(cmd, timeout, name, live, log_dir, keep)
+    if res.get('returncode') == 0:
+        cache.put(key, {k: res[k] for k in ('cmd', 'returncode', 'stdout', 'stderr')})
+    return res
+
+
+def _pump(proc, captures, deadline=None):
+    """Feed the process's pipes into their captures until both close.
+
+    Returns False if `deadline` (a time.monotonic() value) passed first; the
+    process group is then killed.
+    """
+    with selectors.DefaultSelector() as sel:
+        for pipe in captures:
+            sel.register(pipe, selectors.EVENT_READ)
+        while sel.get_map():
+            wait = None if deadline is None else deadline - time.monotonic()
+            if wait is not None and wait <= 0:
+                _kill_group(proc)
+                for key in list(sel.get_map().values()):
+                    sel.unregister(key.fileobj)
+                    key.fileobj.close()
+                return False
+            for key, _ in sel.select(wait):
+                data = os.read(key.fd, READ_SIZE)
+                if data:
+                    captures[key.fileobj].feed(data)
+                else:
+                    sel.unregister(key.fileobj)
+                    key.fileobj.close()
+    return True
+
+
+def _kill_group(proc, sig=signal.SIGKILL):
+    try:
+        os.killpg(proc.pid, sig)
+    except OSError:
+        proc.send_signal(sig)
+
+
+def _cgroup_quota():
+    """CPU limit from the cgroup CPU quota (v2 cpu.max or v1 cfs_quota_us), or None.
+
+    The process's cgroup and its parents are checked; the smallest limit wins.
+    """
+    try:
+        with open('/proc/self/cgroup') as fh:
+            lines = fh.read().splitlines()
+    except OSError:
+        return None
+    limits = []
+    for line in lines:
+        _, controllers, path = line.split(':', 2)
+        if controllers == '':
+            root, files = '/sys/fs/cgroup', ('cpu.max',)
+        elif 'cpu' in controllers.split(','):
+            root, files = '/sys/fs/cgroup/cpu', ('cpu.cfs_quota_us', 'cpu.cfs_period_us')
+        else:
+            continue
+        d = os.path.normpath(root + path)
+        while d.startswith(root):
+            try:
+                values = ' '.join(open(os.path.join(d, f)).read().strip() for f in files).split()
+                if values[0] not in ('max', '-1'):
+                    limits.append(int(values[0]) / int(values[1]))
+            except (OSError, ValueError, IndexError):
+                pass
+            if d == root:
+                break
+            d = os.path.dirname(d)
+    return min(limits) if limits else None
+
+
+def effective_cpus():
+    """CPUs this process may use: its affinity mask, capped by the cgroup CPU quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = _cgroup_quota()
+    if quota:
+        cpus = min(cpus, quota)
+    return max(1.0, float(cpus))
+
+
+def _pressure(resource):
+    """'some avg10' from /proc/pressure/<resource> (percent of time stalled), or None."""
+    try:
+        with open('/proc/pressure/' + resource) as fh:
+            for line in fh:
+                if line.startswith('some'):
+                    return float(line.split()[1].split('=')[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class Capacity:
+    """How many CPUs' worth of commands may run at once.
+
+    Fixed at `limit` (default: effective_cpus()), or with `adaptive` re-checked
+    every `interval` seconds: high load average or CPU/memory pressure (PSI)
+    shrinks it, an idle machine grows it (up to twice the CPU count, or `limit`
+    if that is higher).
+    """
+
+    def __init__(self, limit=None, adaptive=False, interval=1.0):
+        self.cpus = effective_cpus()
+        self.limit = float(limit or self.cpus)
+        self.highest = max(self.limit, 2 * self.cpus)
+        self.adaptive = adaptive
+        self.interval = interval
+        self.checked = time.monotonic()
+
+    def current(self):
+        if self.adaptive and time.monotonic() - self.checked >= self.interval:
+            self.checked = time.monotonic()
+            self._adjust()
+        return self.limit
+
+    def _adjust(self):
+        try:
+            with open('/proc/loadavg') as fh:
+                load = float(fh.read().split()[0]) / self.cpus
+        except (OSError, ValueError):
+            load = None
+        cpu, mem = _pressure('cpu'), _pressure('memory')
+        old = self.limit
+        if (load or 0) > 1.5 or (cpu or 0) > 40 or (mem or 0) > 10:
+            self.limit = max(1.0, self.limit * 0.75)
+        elif (load is None or load < 1.0) and (cpu or 0) < 10 and (mem or 0) < 1:
+            self.limit = min(self.highest, self.limit + 1)
+        if self.limit != old:
+            print('Capacity %.1f -> %.1f (load/cpu %s, cpu psi %s, memory psi %s)'
+                  % (old, self.limit, 'n/a' if load is None else '%.2f' % load, cpu, mem))
 
 
 def _signal_handler(signum, frame):
     print('Received signal', signum, '- shutting down gracefully...')
     shutdown_flag.set()
+    # commands run in their own process groups, so they don't get the terminal's signal themselves
+    with running_lock:
+        groups = list(running_groups)
+    for pgid in groups:
+        try:
+            os.killpg(pgid, signum)
+        except OSError:
+            pass
 
 
-def run_commands(commands, parallel=False, timeout=None):
-    results = []
+def run_commands(commands, parallel=False, timeout=None, live=False, log_dir=None, keep=KEEP_BYTES,
+                 workers=None, adaptive=False, weights=None):
+    """Run commands one after another, or with `parallel` as many at once as the
+    capacity allows (see run_pipeline; `weights` gives each command's CPUs)."""
+    names = ['%d' % (i + 1) for i in range(len(commands))]
     if parallel:
-        with concurrent.futures.ThreadPoolExecutor(max_workers=min(8, len(commands))) as ex:
-            futures = [ex.submit(_run_command, c, timeout) for c in commands]
-            for f in concurrent.futures.as_completed(futures):
-                results.append(f.result())
-    else:
-        for c in commands:
-            if shutdown_flag.is_set():
-                results.append({'cmd': c, 'status': 'skipped'})
-                continue
-            results.append(_run_command(c, timeout))
+        steps = {n: {'cmd': c, 'needs': [], 'weight': w}
+                 for n, c, w in zip(names, commands, weights or [1] * len(commands))}
+        return run_pipeline(steps, workers, timeout, live, log_dir, keep, adaptive)
+    results = []
+    for c, n in zip(commands, names):
+        if shutdown_flag.is_set():
+            results.append({'cmd': c, 'status': 'skipped'})
+            continue
+        results.append(_run_command(c, timeout, n, live, log_dir, keep))
+    return results
+
+
+def load_pipeline(path):
+    """Load a pipeline file with day5's config_loader (JSON, or YAML with PyYAML).
+
+    {"workers": 4, "steps": {"build": {"cmd": "make", "timeout": 600},
+                             "test": {"cmd": "make test", "needs": ["build"], "estimate": 120}}}
+
+    `steps` may also be a list of steps with a "name". `needs` lists the steps
+    that must succeed first; `estimate` (seconds, default 1) is used to rank
+    ready steps by the longest remaining path; `weight` is the number of CPUs
+    the step uses (default 1). Returns (steps, workers).
+    """
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'day5'))
+    from config_loader import load
+
+    cfg = load(path)
+    steps = cfg.get('steps') or {}
+    if isinstance(steps, list):
+        steps = {s['name']: s for s in steps}
+    out = {}
+    for name, spec in steps.items():
+        if isinstance(spec, str):
+            spec = {'cmd': spec}
+        needs = spec.get('needs') or []
+        out[str(name)] = dict(spec, needs=[needs] if isinstance(needs, str) else list(needs))
+    return out, cfg.get('workers')
+
+
+def _critical_paths(steps):
+    """Return (order, rank): a topological order and, per step, the estimated length
+    of the longest path from its start to the end of the pipeline."""
+    for name, spec in steps.items():
+        for dep in spec['needs']:
+            if dep not in steps:
+                raise ValueError('step %r needs unknown step %r' % (name, dep))
+    children = {name: [] for name in steps}
+    indegree = {name: len(spec['needs']) for name, spec in steps.items()}
+    for name, spec in steps.items():
+        for dep in spec['needs']:
+            children[dep].append(name)
+    order = [name for name, n in indegree.items() if n == 0]
+    for name in order:
+        for child in children[name]:
+            indegree[child] -= 1
+            if indegree[child] == 0:
+                order.append(child)
+    if len(order) != len(steps):
+        raise ValueError('dependency cycle between steps: %s' % ', '.join(sorted(set(steps) - set(order))))
+    rank = {}
+    for name in reversed(order):
+        rank[name] = float(steps[name].get('estimate', 1)) + max((rank[c] for c in children[name]), default=0)
+    return order, rank
+
+
+def run_pipeline(steps, workers=None, timeout=None, live=False, log_dir=None, keep=KEEP_BYTES, adaptive=False,
+                 cache=None):
+    """Run pipeline steps as soon as the steps they need have succeeded.
+
+    Steps are packed against a Capacity of `workers` CPUs (default: the
+    effective CPU count, adapted to load with `adaptive`): each running step
+    uses its `weight`, and a step heavier than the whole capacity runs alone.
+    Ready steps are tried in order of longest remaining critical path. When a
+    step fails, every step downstream of it is cancelled. Returns the results
+    in completion order.
+
+    With `cache` (a step_cache.StepCache), steps that declare `inputs` (file
+    globs) or `env` (variable names) are skipped when a successful result for
+    the same command and inputs is stored; the stored result is replayed.
+    """
+    _, rank = _critical_paths(steps)
+    capacity = Capacity(workers, adaptive)
+    index = {name: i for i, name in enumerate(steps)}
+    waiting = {name: set(spec['needs']) for name, spec in steps.items()}
+    ready = [(-rank[name], index[name], name) for name, deps in waiting.items() if not deps]
+    heapq.heapify(ready)
+    for _, _, name in ready:
+        del waiting[name]
+    results = []
+
+    def cancel(failed):
+        # everything that (transitively) needs `failed` can no longer run
+        doomed = [failed]
+        while doomed:
+            dep = doomed.pop()
+            for name in [n for n, deps in waiting.items() if dep in steps[n]['needs']]:
+                del waiting[name]
+                results.append({'step': name, 'cmd': steps[name]['cmd'], 'status': 'cancelled',
+                                'reason': 'needs %s' % dep})
+                doomed.append(name)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(steps))) as ex:
+        running = {}
+        used = 0.0
+        while ready or running:
+            if not shutdown_flag.is_set():
+                limit = capacity.current()
+                deferred = []
+                while ready:
+                    item = heapq.heappop(ready)
+                    spec = steps[item[2]]
+                    weight = float(spec.get('weight', 1))
+                    if running and used + weight > limit:
+                        deferred.append(item)
+                        continue
+                    running[ex.submit(_run_step, spec, item[2], timeout, live, log_dir, keep,
+                                      cache)] = (item[2], weight)
+                    used += weight
+                for item in deferred:
+                    heapq.heappush(ready, item)
+            if not running:
+                break
+            done, _ = concurrent.futures.wait(running, timeout=capacity.interval if adaptive else None,
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            for f in done:
+                name, weight = running.pop(f)
+                used -= weight
+                res = dict(f.result(), step=name)
+                results.append(res)
+                if res.get('returncode') != 0:
+                    cancel(name)
+                    continue
+                for child in [n for n, deps in waiting.items() if name in deps]:
+                    waiting[child].discard(name)
+                    if not waiting[child]:
+                        del waiting[child]
+                        heapq.heappush(ready, (-rank[child], index[child], child))
+    for _, _, name in ready:
+        results.append({'step': name, 'cmd': steps[name]['cmd'], 'status': 'skipped'})
+    for name in waiting:
+        results.append({'step': name, 'cmd': steps[name]['cmd'], 'status': 'skipped'})
     return results
 
 
+def _status(r):
+    if r.get('cached'):
+        return 'cached'
+    if 'returncode' in r:
+        return 'ok' if r['returncode'] == 0 else 'exit %d' % r['returncode']
+    return r.get('status', '?')
+
+
+def format_table(results):
+    """Per-step table: wall time, CPU, peak memory, block I/O and context switches."""
+    head = ('step', 'status', 'wall s', 'user s', 'sys s', 'cpu %', 'maxrss MB', 'blk in', 'blk out',
+            'vcsw', 'ivcsw')
+    rows = [head]
+    for i, r in enumerate(results):
+        row = [str(r.get('step') or i + 1), _status(r)]
+        ru = r.get('rusage')
+        if 'start' in r and ru:
+            wall = r['end'] - r['start']
+            row += ['%.2f' % wall, '%.2f' % ru['user'], '%.2f' % ru['sys'],
+                    '%.0f' % (100.0 * (ru['user'] + ru['sys']) / wall if wall > 0 else 0),
+                    '%.1f' % (ru['maxrss_kb'] / 1024.0), str(ru['inblock']), str(ru['oublock']),
+                    str(ru['nvcsw']), str(ru['nivcsw'])]
+        else:
+            row += ['-'] * (len(head) - 2)
+        rows.append(row)
+    widths = [max(len(row[i]) for row in rows) for i in range(len(head))]
+    return '\n'.join('  '.join(c.ljust(w) if i < 2 else c.rjust(w) for i, (c, w) in enumerate(zip(row, widths)))
+                     for row in rows)
+
+
+def write_trace(results, path):
+    """Write the run as Chrome Trace Event JSON (chrome://tracing, Perfetto).
+
+    Each step is a complete ('X') event on the first free lane, so parallel
+    steps show as parallel tracks; args carry the command, status and rusage.
+    """
+    timed = sorted((r for r in results if 'start' in r), key=lambda r: r['start'])
+    origin = timed[0]['start'] if timed else 0
+    lanes = []  # end time of the last step on each lane
+    events = [{'name': 'process_name', 'ph': 'M', 'pid': 1, 'args': {'name': 'deploy_monitor'}}]
+    for i, r in enumerate(timed):
+        lane = next((n for n, end in enumerate(lanes) if end <= r['start']), len(lanes))
+        if lane == len(lanes):
+            lanes.append(0)
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': lane + 1,
+                           'args': {'name': 'lane %d' % (lane + 1)}})
+        lanes[lane] = r['end']
+        args = {'cmd': r['cmd'], 'status': _status(r)}
+        args.update(r.get('rusage') or {})
+        events.append({'name': str(r.get('step') or i + 1), 'cat': 'step', 'ph': 'X', 'pid': 1, 'tid': lane + 1,
+                       'ts': (r['start'] - origin) * 1e6, 'dur': (r['end'] - r['start']) * 1e6, 'args': args})
+    with open(path, 'w') as fh:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fh)
+
+
 def main():
     signal.signal(signal.SIGINT, _signal_handler)
     signal.signal(signal.SIGTERM, _signal_handler)
 
     p = argparse.ArgumentParser()
-    p.add_argument('--cmd', action='append', required=True, help='Shell command to run (can repeat)')
+    p.add_argument('--cmd', action='append', help='Shell command to run (can repeat)')
+    p.add_argument('--pipeline', help='Pipeline file (JSON/YAML) of steps with dependencies')
     p.add_argument('--parallel', action='store_true')
+    p.add_argument('--workers', type=float, help='CPUs\' worth of commands run at once (default: pipeline file, '
+                                                 'else the cgroup CPU quota or affinity mask)')
+    p.add_argument('--adaptive', action='store_true', help='Shrink/grow --workers with load average and CPU/memory pressure')
     p.add_argument('--timeout', type=int, help='Per-command timeout in seconds')
+    p.add_argument('--live', action='store_true', help='Print output as it arrives, prefixed with [n]')
+    p.add_argument('--log-dir', help='Write each command\'s full output to DIR/<n>.out.log and <n>.err.log')
+    p.add_argument('--cache', help='Result cache directory: skip pipeline steps whose inputs are unchanged')
+    p.add_argument('--cache-size', type=int, default=512, help='Cache size limit in MB (least recently used results go first)')
+    p.add_argument('--trace', help='Write a Chrome Trace Event JSON timeline of the run (open in Perfetto)')
+    p.add_argument('--keep', type=int, default=KEEP_BYTES, help='Bytes kept from the start and end of each stream for the summary')
     args = p.parse_args()
 
+    if not args.cmd and not args.pipeline:
+        p.error('give --cmd or --pipeline')
+
     start = time.time()
-    results = run_commands(args.cmd, parallel=args.parallel, timeout=args.timeout)
+    if args.pipeline:
+        try:
+            steps, workers = load_pipeline(args.pipeline)
+            order, rank = _critical_paths(steps)
+        except Exception as e:
+            print('Error loading pipeline', args.pipeline, e)
+            return
+        print('Critical path estimate: %.1fs over %d steps' % (max(rank.values(), default=0), len(order)))
+        cache = None
+        if args.cache:
+            from step_cache import StepCache
+            cache = StepCache(args.cache, args.cache_size * 1024 * 1024)
+        try:
+            results = run_pipeline(steps, workers=args.workers or workers, timeout=args.timeout, live=args.live,
+                                   log_dir=args.log_dir, keep=args.keep, adaptive=args.adaptive, cache=cache)
+        finally:
+            if cache:
+                cache.close()
+    else:
+        results = run_commands(args.cmd, parallel=args.parallel, timeout=args.timeout, live=args.live,
+                               log_dir=args.log_dir, keep=args.keep, workers=args.workers, adaptive=args.adaptive)
     elapsed = time.time() - start
 
     print('\nSummary (elapsed: %.2fs):' % elapsed)
     for r in results:
-        print('-', r)
+        print('-', {k: v for k, v in r.items() if k not in ('start', 'end', 'rusage')})
+    print()
+    print(format_table(results))
+    if args.trace:
+        write_trace(results, args.trace)
+        print('\nTrace written to', args.trace)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""Content-addressed result cache for deploy_monitor pipeline steps (Day 4)
+
+A step's key is a SHA-256 over its command, the environment variables it
+lists and the contents of its input files. Files are hashed in 4 MB chunks
+on a thread pool, and a file whose (mtime, size, inode) is unchanged since
+the last run reuses its stored digest without being read. Results of
+successful runs are stored as DIR/<key>.json; the least recently used ones
+are removed once the directory grows past its size limit.
+
+Usage:
+  python deploy_monitor.py --pipeline pipeline.json --cache .step-cache
+"""
+import concurrent.futures
+import glob
+import hashlib
+import json
+import os
+import threading
+
+CHUNK = 4 * 1024 * 1024
+
+
+def _hash_chunk(path, offset, size):
+    with open(path, 'rb') as fh:
+        fh.seek(offset)
+        return hashlib.sha256(fh.read(size)).digest()
+
+
+class StepCache:
+    def __init__(self, path, max_bytes=512 * 1024 * 1024, workers=8):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+        self._stat_path = os.path.join(path, 'stat-cache.json')
+        try:
+            with open(self._stat_path) as fh:
+                self._stats = json.load(fh)
+        except (OSError, ValueError):
+            self._stats = {}  # abspath -> [mtime_ns, size, inode, hexdigest]
+        self._lock = threading.Lock()
+        self._pending = {}  # abspath -> (stat signature, chunk futures) being hashed
+        self._ex = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+    def close(self):
+        self._ex.shutdown()
+        with self._lock:
+            tmp = self._stat_path + '.tmp'
+            with open(tmp, 'w') as fh:
+                json.dump(self._stats, fh)
+            os.replace(tmp, self._stat_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _file_digests(self, paths):
+        """Hex digest of each file; unchanged files come from the stat cache, the
+        rest are read in CHUNK-sized pieces in parallel."""
+        digests = {}
+        jobs = {}
+        for p in paths:
+            st = os.stat(p)
+            sig = [st.st_mtime_ns, st.st_size, st.st_ino]
+            key = os.path.abspath(p)
+            with self._lock:
+                hit = self._stats.get(key)
+                if hit and hit[:3] == sig:
+                    digests[p] = hit[3]
+                    continue
+                # steps sharing an input wait for one hashing of it
+                pending = self._pending.get(key)
+                if pending is None or pending[0] != sig:
+                    offsets = range(0, st.st_size, CHUNK) or [0]
+                    pending = self._pending[key] = (sig, [self._ex.submit(_hash_chunk, p, off, CHUNK)
+                                                          for off in offsets])
+            jobs[p] = (key, sig, pending[1])
+        for p, (key, sig, futures) in jobs.items():
+            h = hashlib.sha256()
+            for f in futures:
+                h.update(f.result())
+            digests[p] = h.hexdigest()
+            with self._lock:
+                self._stats[key] = sig + [digests[p]]
+                self._pending.pop(key, None)
+        return digests
+
+    def key(self, cmd, inputs=(), env=()):
+        """Cache key of a command with its input globs and environment variable names."""
+        h = hashlib.sha256()
+        h.update(b'cmd\0' + cmd.encode() + b'\0')
+        for name in sorted(env):
+            value = os.environ.get(name)
+            h.update(('env\0%s\0%s\0' % (name, '\1' if value is None else value)).encode())
+        paths = sorted({p for pattern in inputs for p in glob.glob(pattern, recursive=True) if os.path.isfile(p)})
+        for p, digest in sorted(self._file_digests(paths).items()):
+            h.update(('file\0%s\0%s\0' % (p, digest)).encode())
+        return h.hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.path, key + '.json')
+
+    def get(self, key):
+        """Stored result for `key`, or None; a hit counts as a use for LRU eviction."""
+        entry = self._entry(key)
+        try:
+            with open(entry) as fh:
+                result = json.load(fh)
+            os.utime(entry)
+        except (OSError, ValueError):
+            return None
+        return result
+
+    def put(self, key, result):
+        entry = self._entry(key)
+        tmp = '%s.%d.tmp' % (entry, threading.get_ident())
+        with open(tmp, 'w') as fh:
+            json.dump(result, fh)
+        os.replace(tmp, entry)
+        self._evict()
+
+    def _evict(self):
+        """Remove least recently used results until the cache fits in max_bytes."""
+        entries = []
+        total = 0
+        with os.scandir(self.path) as it:
+            for e in it:
+                if e.name.endswith('.json') and e.name != 'stat-cache.json':
+                    try:
+                        st = e.stat()
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, e.path))
+                    total += st.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
@@ -3,36 +3,71 @@
 - Supports JSON and INI files
 - Merges with environment variables (env overrides)
 - Does simple ${VAR} substitution in string values
+- load_cached/watch: parsed configs cached per file, reloaded when the file changes
+- load_layered: deep-merge files and conf.d directories, with the source of each key
+- optional on-disk snapshots of parsed configs ($CONFIG_SNAPSHOT_DIR) for fast startup
 
 Usage:
   python config_loader.py --file config.json
   python config_loader.py --file config.ini --show
+  python config_loader.py --file config.json --watch   # print the config on every change
+  python config_loader.py --layer base.json --layer conf.d/ --show --provenance
 """
-import argparse
-import configparser
-import json
+import hashlib
+import marshal
 import os
 import re
+import threading
 
+# json, configparser, yaml and the rest are imported where they are used, so
+# that a load() served from a snapshot (see below) imports no parser at all.
 
-def _substitute_env(value):
-    if not isinstance(value, str):
-        return value
-    pattern = re.compile(r"\$\{([A-Za-z0-9_]+)\}")
 
-    def repl(m):
-        return os.environ.get(m.group(1), m.group(0))
+ENV_RE = re.compile(r"\$\{([A-Za-z0-9_]+)\}")
+
+# inotify: IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+IN_WATCH_MASK = 0x004 | 0x008 | 0x080 | 0x100 | 0x200
+
+CONFIG_EXTS = ('.json', '.ini', '.cfg', '.yaml', '.yml')
+
+# bump when parsing or substitution changes, to invalidate existing snapshots
+LOADER_VERSION = 2
 
-    return pattern.sub(repl, value)
+
+def _env_repl(m):
+    return os.environ.get(m.group(1), m.group(0))
+
+
+def _substitute_env(value):
+    """${VAR} substitution in strings, recursing into dicts and lists.
+
+    Containers without anything to substitute are returned as they are.
+    """
+    if isinstance(value, str):
+        return ENV_RE.sub(_env_repl, value) if '${' in value else value
+    if isinstance(value, dict):
+        out = None
+        for k, v in value.items():
+            new = _substitute_env(v)
+            if new is not v:
+                if out is None:
+                    out = dict(value)
+                out[k] = new
+        return value if out is None else out
+    if isinstance(value, list):
+        new = [_substitute_env(v) for v in value]
+        return value if all(a is b for a, b in zip(new, value)) else new
+    return value
 
 
 def load_json(path):
+    import json
     with open(path) as fh:
-        data = json.load(fh)
-    return {k: _substitute_env(v) if isinstance(v, str) else v for k, v in data.items()}
+        return _substitute_env(json.load(fh))
 
 
 def load_ini(path):
+    import configparser
     cp = configparser.ConfigParser()
     cp.read(path)
     out = {}
@@ -41,7 +76,7 @@ def load_ini(path):
     return out
 
 
-def load(path):
+def _parse(path):
     if path.endswith('.json'):
         return load_json(path)
     if path.endswith('.ini') or path.endswith('.cfg'):
@@ -50,16 +85,327 @@ def load(path):
     try:
         import yaml  # type: ignore
         with open(path) as fh:
-            return yaml.safe_load(fh)
+            return _substitute_env(yaml.safe_load(fh))
     except Exception:
         raise ValueError('Unsupported config format or PyYAML not installed')
 
 
+def load(path, snapshot_dir=None):
+    """Parse a JSON, INI or YAML config file, with ${VAR} substitution.
+
+    With `snapshot_dir` (or $CONFIG_SNAPSHOT_DIR) set, the result is also
+    stored there as a binary snapshot, reused while the file's mtime and size,
+    the values of the ${VAR}s it uses and LOADER_VERSION are unchanged: a
+    stat and one read instead of a parse. Snapshots are unpickled on load, so
+    the directory must only be writable by you.
+    """
+    snapshot_dir = snapshot_dir or os.environ.get('CONFIG_SNAPSHOT_DIR')
+    if not snapshot_dir:
+        return _parse(path)
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    head = (LOADER_VERSION, path, st.st_mtime_ns, st.st_size)
+    snap = os.path.join(snapshot_dir, hashlib.sha1(path.encode()).hexdigest() + '.snap')
+    try:
+        with open(snap, 'rb') as fh:
+            cached = _decode(fh.read())
+        if cached[0] == head and all(os.environ.get(k) == v for k, v in cached[1].items()):
+            return cached[2]
+    except Exception:  # a missing, corrupt or stale snapshot is just a miss
+        pass
+    with open(path, errors='replace') as fh:
+        names = set(ENV_RE.findall(fh.read()))
+    cfg = _parse(path)
+    try:
+        _write_snapshot(snapshot_dir, snap, (head, {n: os.environ.get(n) for n in names}, cfg))
+    except OSError as e:
+        print('Error writing config snapshot', snap, e)
+    return cfg
+
+
+def _decode(blob):
+    if blob[:1] == b'M':
+        return marshal.loads(blob[1:])
+    if blob[:1] == b'P':
+        import pickle
+        return pickle.loads(blob[1:])
+    raise ValueError('unknown snapshot format')
+
+
+def _write_snapshot(snapshot_dir, snap, entry):
+    try:
+        blob = b'M' + marshal.dumps(entry)
+    except ValueError:  # e.g. dates from YAML
+        import pickle
+        blob = b'P' + pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL)
+    os.makedirs(snapshot_dir, mode=0o700, exist_ok=True)
+    tmp = '%s.%d.tmp' % (snap, os.getpid())
+    with open(tmp, 'wb') as fh:
+        fh.write(blob)
+    os.replace(tmp, snap)
+
+
+def _fragments(paths_or_dirs):
+    """Config files in precedence order: each directory's files sorted by name."""
+    files = []
+    for p in paths_or_dirs:
+        if not os.path.isdir(p):
+            files.append(p)
+            continue
+        files.extend(sorted(e.path for e in os.scandir(p)
+                            if not e.name.startswith('.') and e.is_file() and e.name.endswith(CONFIG_EXTS)))
+    return files
+
+
+def _merge(base, over, source, prov, owned):
+    """Merge dict `over` into `base` in place, recording `source` in the provenance tree `prov`.
+
+    Dicts from a single fragment are shared, not copied; a shared dict is
+    only copied (and added to `owned`) when a later fragment merges into it.
+    """
+    for k, v in over.items():
+        old = base.get(k)
+        if isinstance(v, dict) and isinstance(old, dict):
+            if id(old) not in owned:
+                old = base[k] = dict(old)
+                owned.add(id(old))
+            if not isinstance(prov.get(k), dict):
+                prov[k] = dict.fromkeys(old, prov.get(k))
+            _merge(old, v, source, prov[k], owned)
+        else:
+            base[k] = v
+            prov[k] = source
+
+
+def load_layered(paths_or_dirs, workers=8):
+    """Load and deep-merge config layers; returns (config, provenance).
+
+    Each entry of `paths_or_dirs` is a config file or a conf.d-style directory
+    whose .json/.ini/.cfg/.yaml/.yml files are taken in name order. Later
+    files win; nested dicts are merged key by key, anything else (lists
+    included) is replaced. The fragments are parsed in a thread pool.
+
+    `provenance` mirrors the config: a key maps to the file that set it, or
+    to a nested dict when several files contributed to it (see source_of()).
+    """
+    import concurrent.futures
+    files = _fragments(paths_or_dirs)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(workers, len(files)))) as ex:
+        parsed = list(ex.map(load, files))
+    cfg, prov, owned = {}, {}, set()
+    for path, data in zip(files, parsed):
+        if not isinstance(data, dict):
+            raise ValueError('Config fragment is not a mapping: %s' % path)
+        _merge(cfg, data, path, prov, owned)
+    return cfg, prov
+
+
+def source_of(provenance, key):
+    """File that set the dotted `key` (e.g. 'db.host') according to load_layered()."""
+    node = provenance
+    for part in key.split('.'):
+        if not isinstance(node, dict) or part not in node:
+            break
+        node = node[part]
+    return node if isinstance(node, str) else None
+
+
+def _flat_sources(provenance, prefix=''):
+    for k, v in provenance.items():
+        if isinstance(v, dict):
+            yield from _flat_sources(v, prefix + k + '.')
+        else:
+            yield prefix + k, v
+
+
+def _signature(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+class ConfigCache:
+    """Parsed configs keyed by path, re-parsed only when the file changes.
+
+    load() costs one stat while the file's (mtime_ns, size, inode) is
+    unchanged, and nothing for files being watched: watch() starts a
+    background thread (inotify on the file's directory, or polling every
+    `interval` seconds) that re-parses changed files, swaps in the new
+    snapshot and calls the file's subscribers with (path, config). A file
+    that fails to parse keeps its previous snapshot. Snapshots are shared
+    between callers; treat them as read-only.
+    """
+
+    def __init__(self, loader=None, interval=1.0):
+        self.loader = loader or load
+        self.interval = interval
+        self._entries = {}  # abspath -> (signature, config)
+        self._watched = {}  # abspath -> [subscribers]
+        self._failed = {}  # abspath -> signature of a version that did not parse
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._inotify = None
+
+    def load(self, path):
+        key = os.path.abspath(path)
+        entry = self._entries.get(key)
+        if entry is not None and key in self._watched:
+            return entry[1]
+        sig = _signature(key)
+        if entry is not None and entry[0] == sig:
+            return entry[1]
+        cfg = self.loader(key)
+        self._entries[key] = (sig, cfg)
+        return cfg
+
+    def subscribe(self, path, callback):
+        """Call callback(path, config) after every reload of a watched `path`."""
+        with self._lock:
+            self._watched.setdefault(os.path.abspath(path), []).append(callback)
+
+    def watch(self, path, callback=None):
+        """Keep `path` loaded and up to date in the background; returns the current config."""
+        key = os.path.abspath(path)
+        cfg = self.load(key)
+        with self._lock:
+            subscribers = self._watched.setdefault(key, [])
+            if callback:
+                subscribers.append(callback)
+            if self._thread is None:
+                self._inotify = _Inotify.create()
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        if self._inotify:
+            self._inotify.add(os.path.dirname(key))
+        return cfg
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._inotify:
+            self._inotify.close()
+            self._inotify = None
+        self._stop.clear()
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self._inotify:
+                self._inotify.wait(self.interval)
+            else:
+                self._stop.wait(self.interval)
+            with self._lock:
+                watched = {k: list(v) for k, v in self._watched.items()}
+            for key, subscribers in watched.items():
+                self._refresh(key, subscribers)
+
+    def _refresh(self, key, subscribers):
+        sig = None
+        try:
+            sig = _signature(key)
+            if sig in (self._entries.get(key, (None,))[0], self._failed.get(key)):
+                return
+            cfg = self.loader(key)
+        except Exception as e:
+            if sig is None or self._failed.get(key) != sig:
+                print('Error reloading', key, e)
+            self._failed[key] = sig
+            return
+        self._failed.pop(key, None)
+        self._entries[key] = (sig, cfg)
+        for fn in subscribers:
+            try:
+                fn(key, cfg)
+            except Exception as e:
+                print('Error in config subscriber', e)
+
+
+class _Inotify:
+    """Minimal inotify wrapper (via ctypes) used by ConfigCache.watch()."""
+
+    def __init__(self, libc, fd):
+        self.libc = libc
+        self.fd = fd
+        self.dirs = set()
+
+    @classmethod
+    def create(cls):
+        """Return an _Inotify, or None when inotify is unavailable (non-Linux)."""
+        try:
+            import ctypes
+            import ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        return cls(libc, fd) if fd >= 0 else None
+
+    def add(self, directory):
+        if directory not in self.dirs and self.libc.inotify_add_watch(self.fd, os.fsencode(directory),
+                                                                      IN_WATCH_MASK) >= 0:
+            self.dirs.add(directory)
+
+    def wait(self, timeout):
+        import select
+        if select.select([self.fd], [], [], timeout)[0]:
+            try:
+                while os.read(self.fd, 65536):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+_cache = ConfigCache()
+
+
+def load_cached(path):
+    """load() through a shared ConfigCache: a stat per call, or free for watched files."""
+    return _cache.load(path)
+
+
+def watch(path, callback=None):
+    """Watch `path` with the shared ConfigCache; see ConfigCache.watch()."""
+    return _cache.watch(path, callback)
+
+
 if __name__ == '__main__':
+    import argparse
+    import json
     p = argparse.ArgumentParser()
-    p.add_argument('--file', required=True)
+    p.add_argument('--file')
+    p.add_argument('--layer', action='append', help='Config file or conf.d directory, lowest precedence first (can repeat)')
     p.add_argument('--show', action='store_true')
+    p.add_argument('--provenance', action='store_true', help='With --layer, print the file that set each key')
+    p.add_argument('--watch', action='store_true', help='Keep running and print the config whenever it changes')
+    p.add_argument('--snapshot-dir', help='Cache parsed configs here (same as $CONFIG_SNAPSHOT_DIR)')
     args = p.parse_args()
+    if not (args.file or args.layer):
+        p.error('one of --file or --layer is required')
+    if args.snapshot_dir:
+        os.environ['CONFIG_SNAPSHOT_DIR'] = args.snapshot_dir
+
+    if args.layer:
+        cfg, prov = load_layered(args.layer)
+        if args.show:
+            print(json.dumps(cfg, indent=2))
+        if args.provenance:
+            for key, source in _flat_sources(prov):
+                print('%s\t%s' % (key, source))
+        if not (args.show or args.provenance):
+            print('Loaded config from', ', '.join(args.layer))
+        raise SystemExit(0)
+
+    if args.watch:
+        print(json.dumps(watch(args.file, lambda path, cfg: print(json.dumps(cfg, indent=2))), indent=2))
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+        raise SystemExit(0)
 
     cfg = load(args.file)
     if args.show:
@@ -1,14 +1,32 @@
 #!/usr/bin/env python3
-"""Container Manager Tool (Day 6) — minimal wrapper around Docker CLI
+"""Container Manager Tool (Day 6) — minimal wrapper around Docker
 
-Basic commands supported: build, run, stop, rm, logs, exec
+Basic commands supported: build, run, ps, stop, rm, logs, exec
+Bulk: `bulk stop|rm|restart|exec` on every container selected by label,
+name regex and/or status, several at a time
+`logs --follow` over several containers (--name, --label) merges their lines
+by timestamp, optionally filtered like log_analyzer (--level, --pattern)
 
-Note: This script calls the `docker` CLI. Ensure Docker is installed and the user has permissions.
+Talks to the Docker Engine API over its unix socket (see docker_api.py) when
+the socket is reachable, and falls back to the `docker` CLI otherwise
+(--backend cli forces the CLI). `build` always uses the CLI.
+
+Note: Ensure Docker is installed and the user has permissions on the socket or CLI.
 """
 import argparse
+import concurrent.futures
+import heapq
+import json
+import os
+import queue
+import re
 import shutil
 import subprocess
 import sys
+import threading
+import time
+
+from docker_api import DockerClient, DockerError
 
 
 def check_docker_available():
@@ -20,12 +38,291 @@ def docker(args_list):
     return subprocess.run(cmd, capture_output=True, text=True)
 
 
-def main():
-    if not check_docker_available():
-        print('docker CLI not found in PATH. Install Docker or run on a host with Docker.')
-        sys.exit(1)
+def get_client(socket_path=None, pool_size=8):
+    """A DockerClient if the Engine API answers on the socket, else None."""
+    client = DockerClient(socket_path, pool_size=pool_size)
+    if not os.path.exists(client.socket_path):
+        return None
+    try:
+        client.ping()
+    except (OSError, DockerError):
+        client.close()
+        return None
+    return client
+
+
+def select_containers(client=None, labels=None, name_regex=None, status=None):
+    """Containers (running or not) matching every given selector, as [{'id', 'name', 'state'}].
+
+    `labels` are 'key' or 'key=value' strings, `status` a list of states
+    ('running', 'exited', ...). Uses the API when `client` is given, else `docker ps`.
+    """
+    if client is not None:
+        filters = {}
+        if labels:
+            filters['label'] = labels
+        if status:
+            filters['status'] = status
+        found = [{'id': c['Id'], 'name': c['Names'][0].lstrip('/'), 'state': c['State']}
+                 for c in client.containers(all=True, filters=filters)]
+    else:
+        cmd = ['ps', '--all', '--no-trunc', '--format', '{{json .}}']
+        for f in (labels or []):
+            cmd += ['--filter', 'label=' + f]
+        for f in (status or []):
+            cmd += ['--filter', 'status=' + f]
+        r = docker(cmd)
+        if r.returncode:
+            raise RuntimeError(r.stderr.strip())
+        found = [{'id': c['ID'], 'name': c['Names'].split(',')[0], 'state': c['State']}
+                 for c in map(json.loads, filter(None, r.stdout.splitlines()))]
+    if name_regex:
+        match = re.compile(name_regex).search
+        found = [c for c in found if match(c['name'])]
+    return sorted(found, key=lambda c: c['name'])
+
+
+def _bulk_one(client, op, container, timeout, grace, force, exec_cmd):
+    """Run one operation; returns (exit code, output). Raises on errors and timeouts."""
+    if client is not None:
+        if op == 'stop':
+            client.stop(container, grace, timeout)
+        elif op == 'restart':
+            client.restart(container, grace, timeout)
+        elif op == 'rm':
+            client.remove(container, force, timeout)
+        else:
+            code, out, err = client.exec(container, exec_cmd, timeout)
+            return code, out + err
+        return 0, ''
+    if op in ('stop', 'restart'):
+        cmd = [op] + (['--time', str(grace)] if grace is not None else []) + [container]
+    elif op == 'rm':
+        cmd = ['rm'] + (['--force'] if force else []) + [container]
+    else:
+        cmd = ['exec', container] + exec_cmd
+    r = subprocess.run(['docker'] + cmd, capture_output=True, text=True, timeout=timeout)
+    if op != 'exec' and r.returncode:
+        raise RuntimeError(r.stderr.strip())
+    return r.returncode, r.stdout + r.stderr
+
+
+def bulk(op, containers, client=None, workers=16, timeout=None, grace=None, force=False, exec_cmd=None):
+    """Apply `op` (stop, rm, restart or exec) to every container, `workers` at a time.
+
+    Each operation is limited to `timeout` seconds (default: the grace period
+    plus 30 s). Returns {'op', 'selected', 'ok', 'failed', 'seconds', 'results'}
+    where results has one {'name', 'ok', 'seconds', ...} per container, in order.
+    """
+    if timeout is None:
+        timeout = (grace if grace is not None else 10) + 30
+
+    def one(c):
+        t0 = time.monotonic()
+        res = {'name': c['name'], 'ok': False}
+        try:
+            code, out = _bulk_one(client, op, c['id'], timeout, grace, force, exec_cmd)
+            res['ok'] = code == 0
+            if op == 'exec':
+                res['exit_code'] = code
+                res['output'] = out
+        except (subprocess.TimeoutExpired, TimeoutError):
+            res['error'] = 'timed out after %ss' % timeout
+        except (OSError, DockerError, RuntimeError) as e:
+            res['error'] = str(e)
+        res['seconds'] = round(time.monotonic() - t0, 3)
+        return res
+
+    t0 = time.monotonic()
+    results = []
+    if containers:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(workers, len(containers)))) as ex:
+            results = list(ex.map(one, containers))
+    ok = sum(r['ok'] for r in results)
+    return {'op': op, 'selected': len(containers), 'ok': ok, 'failed': len(results) - ok,
+            'seconds': round(time.monotonic() - t0, 3), 'results': results}
+
+
+def run_bulk(client, args):
+    if not (args.label or args.name_regex or args.status):
+        print('bulk needs at least one of --label, --name-regex or --status')
+        return 2
+    if args.op == 'exec' and not args.cmd_line:
+        print('bulk exec needs --cmd')
+        return 2
+    containers = select_containers(client, args.label, args.name_regex, args.status)
+    if args.dry_run:
+        print(json.dumps(containers, indent=2))
+        return 0
+    result = bulk(args.op, containers, client, args.workers, args.timeout, args.grace, args.force,
+                  args.cmd_line.split() if args.cmd_line else None)
+    print(json.dumps(result, indent=2))
+    return 1 if result['failed'] else 0
+
+
+def _ts_key(ts):
+    """Sort key for Docker's RFC 3339 timestamps, whose fractions vary in length."""
+    whole, _, frac = ts.rstrip('Z').partition('.')
+    return whole, frac.ljust(9, '0')
+
+
+def _cli_log_lines(name, follow=False, tail='all'):
+    """log_lines() for the CLI backend: (timestamp, stream, line) from `docker logs --timestamps`."""
+    cmd = ['docker', 'logs', '--timestamps', '--tail', str(tail)] + (['--follow'] if follow else []) + [name]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors='replace')
+    try:
+        for line in proc.stdout:
+            ts, _, text = line.rstrip('\n').partition(' ')
+            yield ts, 1, text
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def merge_streams(sources, window=0.02, buffer=1000):
+    """Merge iterables of (timestamp, stream, line) into one, ordered by timestamp.
+
+    Each source is read by its own thread into a queue of at most `buffer`
+    lines. A line is yielded, as (source index, timestamp, line), once every
+    source still open has a line waiting, or once it has waited `window`
+    seconds for the quiet ones, so live output is late by at most `window`.
+    """
+    cond = threading.Condition()
+    seq = [0]
+    queues = [queue.Queue(buffer) for _ in sources]
+
+    def put(q, item):
+        q.put(item)
+        with cond:
+            seq[0] += 1
+            cond.notify()
+
+    def pump(q, lines):
+        try:
+            for ts, _, text in lines:
+                put(q, (time.monotonic(), ts, text))
+        except Exception as e:
+            put(q, (time.monotonic(), '', 'Error reading logs: %s' % e))
+        finally:
+            put(q, None)
+
+    for q, lines in zip(queues, sources):
+        threading.Thread(target=pump, args=(q, lines), daemon=True).start()
+
+    open_ = set(range(len(sources)))
+    heap = []  # (timestamp key, source, arrival, timestamp, line); one line per source
+    queued = set()
+    while open_ or heap:
+        with cond:
+            seen = seq[0]
+        for i in open_ - queued:
+            try:
+                item = queues[i].get_nowait()
+            except queue.Empty:
+                continue
+            if item is None:
+                open_.discard(i)
+                continue
+            heapq.heappush(heap, (_ts_key(item[1]), i, item[0], item[1], item[2]))
+            queued.add(i)
+        if not open_ and not heap:
+            break
+        wait = None
+        if heap:
+            wait = 0 if open_ <= queued else window - (time.monotonic() - min(h[2] for h in heap))
+            if wait <= 0:
+                _, i, _, ts, text = heapq.heappop(heap)
+                queued.discard(i)
+                yield i, ts, text
+                continue
+        with cond:
+            if seq[0] == seen:
+                cond.wait(wait)
 
+
+def logs_main(client, args):
+    """logs over one or more containers, merged; returns the exit status."""
+    names = list(args.name or [])
+    if args.label:
+        status = ['running'] if args.follow else None
+        names += [c['name'] for c in select_containers(client, args.label, status=status) if c['name'] not in names]
+    if not names:
+        print('No containers selected')
+        return 1
+    if client is not None:
+        sources = [client.log_lines(n, args.follow, args.tail) for n in names]
+    else:
+        sources = [_cli_log_lines(n, args.follow, args.tail) for n in names]
+    width = max(map(len, names))
+    lines = ('%s%-*s | %s' % (ts + ' ' if args.timestamps else '', width, names[i], text)
+             for i, ts, text in merge_streams(sources, args.merge_window))
+    stats = None
+    if args.level or args.pattern:
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'day2'))
+        from log_analyzer import filter_lines
+
+        stats = {}
+        pattern = args.pattern[0] if args.pattern and len(args.pattern) == 1 else args.pattern
+        lines = (l if isinstance(l, str) else l[0] for l in filter_lines(lines, args.level, pattern, stats))
+    try:
+        for line in lines:
+            print(line, flush=True)
+    except KeyboardInterrupt:
+        pass
+    if stats is not None:
+        print('Total lines scanned:', stats['total_lines'], file=sys.stderr)
+        print('Counts by level:', dict(stats['level_counts']), file=sys.stderr)
+    return 0
+
+
+def run_api(client, args):
+    """Run one subcommand through the Engine API; returns the exit status."""
+    if args.cmd == 'run':
+        cid = client.run(args.name, args.image)
+        if args.detached:
+            print(cid)
+            return 0
+        code = client.wait(cid)
+        out, err = client.logs(cid, tail='all')
+        print(out, end='')
+        print(err, end='', file=sys.stderr)
+        return code
+
+    if args.cmd == 'ps':
+        print(json.dumps(client.containers(all=args.all), indent=2))
+
+    if args.cmd == 'bulk':
+        return run_bulk(client, args)
+
+    if args.cmd == 'stop':
+        client.stop(args.name)
+        print(args.name)
+
+    if args.cmd == 'rm':
+        client.remove(args.name)
+        print(args.name)
+
+    if args.cmd == 'logs' and args.merged:
+        return logs_main(client, args)
+
+    if args.cmd == 'logs':
+        out, err = client.logs(args.name, tail=args.tail)
+        print(out, end='')
+        print(err, end='', file=sys.stderr)
+
+    if args.cmd == 'exec':
+        code, out, err = client.exec(args.name, args.cmd_line.split())
+        print(out, end='')
+        print(err, end='', file=sys.stderr)
+        return code
+    return 0
+
+
+def main():
     p = argparse.ArgumentParser()
+    p.add_argument('--backend', choices=['auto', 'api', 'cli'], default='auto',
+                   help='Engine API over the socket, the docker CLI, or the API when reachable (default)')
+    p.add_argument('--socket', help='Docker socket path (default $DOCKER_HOST or /var/run/docker.sock)')
     sub = p.add_subparsers(dest='cmd', required=True)
 
     b = sub.add_parser('build')
@@ -37,6 +334,9 @@ def main():
     r.add_argument('--image', required=True)
     r.add_argument('--detached', action='store_true')
 
+    ps = sub.add_parser('ps')
+    ps.add_argument('--all', '-a', action='store_true')
+
     s = sub.add_parser('stop')
     s.add_argument('--name', required=True)
 
@@ -44,14 +344,60 @@ def main():
     rm.add_argument('--name', required=True)
 
     l = sub.add_parser('logs')
-    l.add_argument('--name', required=True)
+    l.add_argument('--name', action='append', help='Container (can repeat)')
+    l.add_argument('--label', action='append', help='Also containers with this key or key=value label (can repeat)')
     l.add_argument('--tail', type=int, default=100)
+    l.add_argument('--follow', '-f', action='store_true', help='Keep printing new lines')
+    l.add_argument('--timestamps', action='store_true', help='Prefix lines with their Docker timestamp')
+    l.add_argument('--level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                   help='Only lines of this level (as log_analyzer --level)')
+    l.add_argument('--pattern', action='append', help='Only lines matching this regex (can repeat)')
+    l.add_argument('--merge-window', type=float, default=0.02, metavar='SECONDS',
+                   help='How long a line may wait for earlier lines from quieter containers (default 0.02)')
 
     e = sub.add_parser('exec')
     e.add_argument('--name', required=True)
-    e.add_argument('--cmd', required=True)
+    e.add_argument('--cmd', dest='cmd_line', required=True)
+
+    bk = sub.add_parser('bulk', help='Run an operation on every selected container in parallel')
+    bk.add_argument('op', choices=['stop', 'rm', 'restart', 'exec'])
+    bk.add_argument('--label', action='append', help='key or key=value (can repeat; all must match)')
+    bk.add_argument('--name-regex', help='Only containers whose name matches this regex')
+    bk.add_argument('--status', action='append', help='running, exited, created, paused, ... (can repeat)')
+    bk.add_argument('--workers', type=int, default=16, help='Operations in flight at once (default 16)')
+    bk.add_argument('--timeout', type=float, help='Seconds per operation (default grace + 30)')
+    bk.add_argument('--grace', type=int, help='Seconds to wait before killing, for stop/restart')
+    bk.add_argument('--force', action='store_true', help='rm: remove running containers too')
+    bk.add_argument('--cmd', dest='cmd_line', help='exec: command to run')
+    bk.add_argument('--dry-run', action='store_true', help='Only print the selected containers')
 
     args = p.parse_args()
+    if args.cmd == 'logs':
+        if not (args.name or args.label):
+            p.error('logs needs --name or --label')
+        # one container without extras keeps the plain `docker logs` output
+        args.merged = bool(len(args.name or []) != 1 or args.label or args.follow or args.timestamps
+                           or args.level or args.pattern)
+        if not args.merged:
+            args.name = args.name[0]
+
+    client = None
+    if args.backend != 'cli' and args.cmd != 'build':
+        client = get_client(args.socket, pool_size=getattr(args, 'workers', 8))
+        if client is None and args.backend == 'api':
+            print('Docker Engine API not reachable on the socket.')
+            sys.exit(1)
+    if client is not None:
+        try:
+            with client:
+                sys.exit(run_api(client, args))
+        except (OSError, DockerError) as e:
+            print('Error:', e)
+            sys.exit(1)
+
+    if not check_docker_available():
+        print('docker CLI not found in PATH. Install Docker or run on a host with Docker.')
+        sys.exit(1)
 
     if args.cmd == 'build':
         r = docker(['build', '-t', args.tag, args.path])
@@ -68,6 +414,17 @@ def main():
         r = docker(cmd)
         print(r.stdout)
 
+    if args.cmd == 'ps':
+        r = docker(['ps', '--format', '{{json .}}'] + (['--all'] if args.all else []))
+        print(json.dumps([json.loads(line) for line in r.stdout.splitlines() if line], indent=2))
+
+    if args.cmd == 'bulk':
+        try:
+            sys.exit(run_bulk(None, args))
+        except RuntimeError as e:
+            print('Error:', e)
+            sys.exit(1)
+
     if args.cmd == 'stop':
         r = docker(['stop', args.name])
         print(r.stdout)
@@ -76,13 +433,16 @@ def main():
         r = docker(['rm', args.name])
         print(r.stdout)
 
+    if args.cmd == 'logs' and args.merged:
+        sys.exit(logs_main(None, args))
+
     if args.cmd == 'logs':
         r = docker(['logs', '--tail', str(args.tail), args.name])
         print(r.stdout)
 
     if args.cmd == 'exec':
         # simple exec (no tty)
-        r = docker(['exec', args.name] + args.cmd.split())
+        r = docker(['exec', args.name] + args.cmd_line.split())
         print(r.stdout)
 
 
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""Docker Engine API client over the unix socket (Day 6)
+
+Used by container_manager.py instead of running the `docker` CLI for every
+operation: requests go over keep-alive HTTP connections to
+/var/run/docker.sock (or $DOCKER_HOST=unix://...), and results come back as
+the Engine's own JSON rather than CLI text.
+
+Usage:
+  python docker_api.py ps
+  python docker_api.py inspect web
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import struct
+import threading
+import time
+import urllib.parse
+
+DEFAULT_SOCKET = '/var/run/docker.sock'
+
+# log lines are cut to this many bytes
+MAX_LINE = 64 * 1024
+
+
+class DockerError(Exception):
+    def __init__(self, status, message):
+        super().__init__('%s (HTTP %d)' % (message, status))
+        self.status = status
+        self.message = message
+
+
+def default_socket():
+    host = os.environ.get('DOCKER_HOST', '')
+    if host.startswith('unix://'):
+        return host[len('unix://'):]
+    return DEFAULT_SOCKET
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout):
+        super().__init__('localhost', timeout=timeout)
+        self._path = path
+        self.unix_sock = None
+
+    def connect(self):
+        # a unix socket with a full accept backlog fails with EAGAIN at once; retry until the timeout
+        deadline = time.monotonic() + (self.timeout or 60)
+        delay = 0.005
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self._path)
+            except BlockingIOError:
+                sock.close()
+                if time.monotonic() + delay > deadline:
+                    raise
+                time.sleep(delay)
+                delay = min(delay * 2, 0.2)
+                continue
+            except OSError:
+                sock.close()
+                raise
+            self.sock = self.unix_sock = sock  # unix_sock stays set while a response still reads from it
+            return
+
+
+def _frames(resp):
+    """Yield (stream, bytes) from a multiplexed stdout/stderr response (1 = stdout, 2 = stderr)."""
+    while True:
+        header = resp.read(8)
+        if len(header) < 8:
+            return
+        stream, size = struct.unpack('>BxxxL', header)
+        yield stream, resp.read(size)
+
+
+class DockerClient:
+    """Engine API client; idle connections are kept for reuse (at most `pool_size`).
+
+    Methods return the decoded JSON of the Engine API and raise DockerError
+    for error responses. The client is safe to use from several threads.
+    """
+
+    def __init__(self, socket_path=None, timeout=60, pool_size=8):
+        self.socket_path = socket_path or default_socket()
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _get_conn(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return _UnixHTTPConnection(self.socket_path, self.timeout), False
+
+    def _put_conn(self, conn):
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def _open(self, method, path, params=None, body=None, timeout=None):
+        """Send a request and return (connection, response) with the body unread.
+
+        The caller reads the body and hands the connection to _done().
+        """
+        if params:
+            path += '?' + urllib.parse.urlencode({k: v for k, v in params.items() if v is not None})
+        headers = {'Host': 'docker'}
+        if body is not None:
+            body = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        while True:
+            conn, reused = self._get_conn()
+            try:
+                if conn.sock is None:
+                    conn.connect()
+                conn.sock.settimeout(self.timeout if timeout is None else (timeout or None))
+                conn.request(method, path, body=body, headers=headers)
+                resp = conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                if reused:
+                    continue  # the daemon closed an idle keep-alive connection
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            if resp.status >= 400:
+                data = resp.read()
+                self._done(conn, resp)
+                try:
+                    message = json.loads(data).get('message', '')
+                except ValueError:
+                    message = data.decode(errors='replace').strip()
+                raise DockerError(resp.status, message or resp.reason)
+            return conn, resp
+
+    def _done(self, conn, resp):
+        if resp.will_close or not resp.isclosed():
+            conn.close()
+        else:
+            self._put_conn(conn)
+
+    def request(self, method, path, params=None, body=None, timeout=None):
+        """One API call; returns the decoded JSON body (None when empty)."""
+        conn, resp = self._open(method, path, params, body, timeout)
+        try:
+            data = resp.read()
+        except BaseException:
+            conn.close()
+            raise
+        self._done(conn, resp)
+        return json.loads(data) if data else None
+
+    def stream(self, method, path, params=None, body=None, timeout=None):
+        """Open a streaming call; returns (response, release) where release() must be called when done.
+
+        timeout=0 waits for data indefinitely (for followed streams).
+        """
+        conn, resp = self._open(method, path, params, body, timeout)
+        return resp, lambda: self._done(conn, resp)
+
+    def ping(self):
+        conn, resp = self._open('GET', '/_ping', timeout=min(self.timeout, 5))
+        resp.read()
+        self._done(conn, resp)
+        return True
+
+    def version(self):
+        return self.request('GET', '/version')
+
+    def containers(self, all=False, filters=None):
+        """Container summaries like `docker ps`; `filters` is e.g. {'label': ['app=web']}."""
+        params = {'all': int(all)}
+        if filters:
+            params['filters'] = json.dumps(filters)
+        return self.request('GET', '/containers/json', params)
+
+    def inspect(self, name):
+        return self.request('GET', '/containers/%s/json' % urllib.parse.quote(name))
+
+    def pull(self, image):
+        """Pull `image`, waiting for the progress stream to end."""
+        ref, _, tag = image.rpartition(':') if ':' in image.rsplit('/', 1)[-1] else (image, '', 'latest')
+        resp, release = self.stream('POST', '/images/create', {'fromImage': ref, 'tag': tag}, timeout=None)
+        try:
+            for line in resp:
+                msg = json.loads(line)
+                if msg.get('error'):
+                    raise DockerError(500, msg['error'])
+        finally:
+            release()
+
+    def create(self, name, image, cmd=None, labels=None):
+        body = {'Image': image, 'Labels': labels or {}}
+        if cmd:
+            body['Cmd'] = cmd
+        try:
+            return self.request('POST', '/containers/create', {'name': name}, body)
+        except DockerError as e:
+            if e.status != 404:
+                raise
+        self.pull(image)
+        return self.request('POST', '/containers/create', {'name': name}, body)
+
+    def start(self, name):
+        self.request('POST', '/containers/%s/start' % urllib.parse.quote(name))
+
+    def run(self, name, image, cmd=None, labels=None):
+        """Create and start a container (pulling the image if needed); returns its id."""
+        cid = self.create(name, image, cmd, labels)['Id']
+        self.start(cid)
+        return cid
+
+    def wait(self, name, timeout=None):
+        """Wait for a container to exit; returns its exit code."""
+        return self.request('POST', '/containers/%s/wait' % urllib.parse.quote(name), timeout=timeout)['StatusCode']
+
+    def stop(self, name, grace=None, timeout=None):
+        """Stop a container; the call may take up to `grace` seconds (Docker's default is 10)."""
+        if timeout is None:
+            timeout = self.timeout + (grace if grace is not None else 10)
+        try:
+            self.request('POST', '/containers/%s/stop' % urllib.parse.quote(name), {'t': grace}, timeout=timeout)
+        except DockerError as e:
+            if e.status != 304:  # already stopped
+                raise
+
+    def restart(self, name, grace=None, timeout=None):
+        if timeout is None:
+            timeout = self.timeout + (grace if grace is not None else 10)
+        self.request('POST', '/containers/%s/restart' % urllib.parse.quote(name), {'t': grace}, timeout=timeout)
+
+    def remove(self, name, force=False, timeout=None):
+        self.request('DELETE', '/containers/%s' % urllib.parse.quote(name), {'force': int(force)}, timeout=timeout)
+
+    def logs(self, name, tail=100, timestamps=False):
+        """Last `tail` lines of output; returns (stdout, stderr) as text."""
+        tty = self.inspect(name)['Config'].get('Tty')
+        resp, release = self.stream('GET', '/containers/%s/logs' % urllib.parse.quote(name),
+                                    {'stdout': 1, 'stderr': 1, 'tail': tail, 'timestamps': int(timestamps)})
+        out = {1: [], 2: []}
+        try:
+            if tty:
+                out[1].append(resp.read())
+            else:
+                for stream, data in _frames(resp):
+                    out.setdefault(stream, []).append(data)
+        finally:
+            release()
+        return b''.join(out[1]).decode(errors='replace'), b''.join(out[2]).decode(errors='replace')
+
+    def log_lines(self, name, follow=False, tail='all', since=None):
+        """Yield (timestamp, stream, line) as the container writes them; stream is 1 (stdout) or 2 (stderr).
+
+        Reads incrementally, holding at most one partial line per stream; lines
+        longer than MAX_LINE bytes are cut. `since` is a Unix time; timestamps are Docker's RFC 3339 strings.
+        """
+        tty = self.inspect(name)['Config'].get('Tty')
+        resp, release = self.stream('GET', '/containers/%s/logs' % urllib.parse.quote(name),
+                                    {'stdout': 1, 'stderr': 1, 'timestamps': 1, 'tail': tail,
+                                     'follow': int(follow), 'since': since}, timeout=0 if follow else None)
+        partial = {1: b'', 2: b''}
+        cut = set()  # streams whose current line is past MAX_LINE
+        try:
+            chunks = ((1, data) for data in iter(lambda: resp.read1(MAX_LINE), b'')) if tty else _frames(resp)
+            for stream, data in chunks:
+                if stream in cut:
+                    end = data.find(b'\n')
+                    if end < 0:
+                        continue
+                    cut.discard(stream)
+                    data = data[end:]
+                lines = (partial.get(stream, b'') + data).split(b'\n')
+                rest = lines.pop()
+                if len(rest) > MAX_LINE:
+                    rest = rest[:MAX_LINE]
+                    cut.add(stream)
+                partial[stream] = rest
+                for raw in lines:
+                    ts, _, text = raw[:MAX_LINE].decode(errors='replace').rstrip('\r').partition(' ')
+                    yield ts, stream, text
+            for stream, rest in partial.items():
+                if rest:
+                    ts, _, text = rest.decode(errors='replace').partition(' ')
+                    yield ts, stream, text
+        finally:
+            release()
+
+    def exec(self, name, cmd, timeout=None):
+        """Run `cmd` (a list) in a running container; returns (exit code, stdout, stderr).
+
+        `timeout` limits the whole call, however steadily the command writes
+        output; TimeoutError is raised when it runs out.
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+
+        def left():
+            if deadline is None:
+                return None
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError('exec did not finish within %ss' % timeout)
+            return remaining
+
+        eid = self.request('POST', '/containers/%s/exec' % urllib.parse.quote(name),
+                           body={'Cmd': cmd, 'AttachStdout': True, 'AttachStderr': True}, timeout=left())['Id']
+        conn, resp = self._open('POST', '/exec/%s/start' % eid, body={'Detach': False, 'Tty': False},
+                                timeout=left())
+        out = {1: [], 2: []}
+        try:
+            for stream, data in _frames(resp):
+                out.setdefault(stream, []).append(data)
+                if deadline is not None:
+                    conn.unix_sock.settimeout(left())
+        finally:
+            self._done(conn, resp)
+        code = self.request('GET', '/exec/%s/json' % eid, timeout=left())['ExitCode']
+        return code, b''.join(out[1]).decode(errors='replace'), b''.join(out[2]).decode(errors='replace')
+
+
+def main():
+    p = argparse.ArgumentParser(description='Query the Docker Engine API')
+    p.add_argument('--socket', help='Docker socket path (default $DOCKER_HOST or %s)' % DEFAULT_SOCKET)
+    p.add_argument('what', choices=['ps', 'inspect', 'version'])
+    p.add_argument('name', nargs='?')
+    args = p.parse_args()
+    with DockerClient(args.socket) as client:
+        try:
+            if args.what == 'ps':
+                result = client.containers(all=True)
+            elif args.what == 'inspect':
+                result = client.inspect(args.name)
+            else:
+                result = client.version()
+        except (OSError, DockerError) as e:
+            print('Error talking to Docker:', e)
+            raise SystemExit(1)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
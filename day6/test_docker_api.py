@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""Tests for docker_api against a stand-in Engine on a unix socket (Day 6)
+
+Run:
+  python -m pytest day6/test_docker_api.py
+  python day6/test_docker_api.py
+"""
+import http.server
+import io
+import json
+import os
+import socket
+import socketserver
+import struct
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from container_manager import bulk  # noqa: E402
+from docker_api import DockerClient, DockerError, _frames  # noqa: E402
+
+
+def frame(stream, data):
+    return struct.pack('>BxxxL', stream, len(data)) + data
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+            self.server.sockets.append(self.connection)
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, code, body=b'', ctype='application/json'):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.requests += 1
+        path = self.path.split('?')[0]
+        if path == '/_ping':
+            self._send(200, b'OK', 'text/plain')
+        elif path == '/containers/json':
+            self._send(200, [{'Id': 'abc', 'Names': ['/web'], 'State': 'running'}])
+        elif path == '/containers/web/json':
+            self._send(200, {'Id': 'abc', 'Config': {'Tty': False}})
+        elif path == '/containers/web/logs':
+            ts = b'2026-01-01T00:00:00Z ' if 'timestamps=1' in self.path else b''
+            body = frame(1, ts + b'out 1\n' + ts + b'out ') + frame(2, ts + b'err 1\n') + frame(1, b'2\n')
+            self._send(200, body, 'application/vnd.docker.multiplexed-stream')
+        else:
+            self._send(404, {'message': 'No such container: ' + path.split('/')[2]})
+
+    def do_POST(self):
+        self.server.requests += 1
+        length = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(length)
+        if self.path.startswith('/containers/web/stop'):
+            self._send(204)
+        elif self.path.startswith('/containers/chatty/exec'):
+            self._send(201, {'Id': 'e1'})
+        elif self.path.startswith('/exec/e1/start'):
+            # a command that never stops printing
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/vnd.docker.multiplexed-stream')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.close_connection = True
+            try:
+                for i in range(200):
+                    self.wfile.write(frame(1, b'tick %d\n' % i))
+                    self.wfile.flush()
+                    time.sleep(0.02)
+            except OSError:
+                pass
+        elif self.path.startswith('/containers/web/start'):
+            self._send(409, {'message': 'container already started'})
+        else:
+            self._send(404, b'page not found', 'text/plain')
+
+    def do_DELETE(self):
+        self.server.requests += 1
+        time.sleep(0.5)  # removing a container with a large writable layer
+        self._send(204)
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path):
+        super().__init__(path, _Handler)
+        self.lock = threading.Lock()
+        self.connections = self.requests = 0
+        self.sockets = []
+
+    def get_request(self):
+        conn, _ = super().get_request()
+        return conn, ('unix', 0)  # BaseHTTPRequestHandler wants a (host, port) address
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], OSError):  # a client that timed out hung up mid-reply
+            super().handle_error(request, client_address)
+
+    def drop_connections(self):
+        """Close every open connection from the server side, like the daemon's idle timeout."""
+        with self.lock:
+            socks, self.sockets = self.sockets, []
+        for s in socks:
+            try:
+                s.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class DockerClientTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'docker.sock')
+        self.server = _Server(self.path)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = DockerClient(self.path, timeout=5)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def test_ping(self):
+        self.assertTrue(self.client.ping())
+
+    def test_missing_socket(self):
+        with DockerClient(os.path.join(self.tmp.name, 'nope.sock')) as client:
+            self.assertRaises(OSError, client.ping)
+
+    def test_connection_is_reused(self):
+        self.client.ping()
+        for _ in range(5):
+            self.assertEqual(self.client.containers()[0]['Names'], ['/web'])
+        self.client.stop('web')
+        self.assertEqual(self.server.requests, 7)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_stale_connection_is_retried(self):
+        self.client.ping()
+        self.server.drop_connections()
+        time.sleep(0.05)
+        self.assertEqual(self.client.inspect('web')['Id'], 'abc')
+        self.assertEqual(self.server.connections, 2)
+
+    def test_error_response(self):
+        with self.assertRaises(DockerError) as cm:
+            self.client.inspect('db')
+        self.assertEqual(cm.exception.status, 404)
+        self.assertEqual(cm.exception.message, 'No such container: db')
+        with self.assertRaises(DockerError) as cm:
+            self.client.start('web')
+        self.assertEqual(cm.exception.status, 409)
+        with self.assertRaises(DockerError) as cm:
+            self.client.request('POST', '/nothing')
+        self.assertEqual(cm.exception.message, 'page not found')
+        # the connection is still usable after errors
+        self.assertTrue(self.client.ping())
+        self.assertEqual(self.server.connections, 1)
+
+    def test_remove_timeout(self):
+        t0 = time.monotonic()
+        self.assertRaises(TimeoutError, self.client.remove, 'web', timeout=0.1)
+        self.assertLess(time.monotonic() - t0, 0.4)
+        self.client.remove('web')
+
+    def test_exec_timeout_with_steady_output(self):
+        t0 = time.monotonic()
+        self.assertRaises(TimeoutError, self.client.exec, 'chatty', ['yes'], timeout=0.3)
+        self.assertLess(time.monotonic() - t0, 1)
+        self.assertTrue(self.client.ping())
+
+    def test_bulk_timeout(self):
+        containers = [{'name': 'chatty', 'id': 'chatty'}, {'name': 'web', 'id': 'web'}]
+        res = bulk('exec', containers[:1], self.client, timeout=0.3, exec_cmd=['yes'])
+        self.assertEqual(res['results'][0]['error'], 'timed out after 0.3s')
+        res = bulk('rm', containers[1:], self.client, timeout=0.1)
+        self.assertEqual(res['failed'], 1)
+        self.assertLess(res['seconds'], 0.4)
+
+    def test_frames(self):
+        data = frame(1, b'hello\n') + frame(2, b'oops\n') + frame(1, b'') + frame(1, b'bye')
+        self.assertEqual(list(_frames(io.BytesIO(data))),
+                         [(1, b'hello\n'), (2, b'oops\n'), (1, b''), (1, b'bye')])
+        # a truncated header ends the stream
+        self.assertEqual(list(_frames(io.BytesIO(frame(1, b'x') + b'\x01\x00'))), [(1, b'x')])
+
+    def test_logs_are_demultiplexed(self):
+        self.assertEqual(self.client.logs('web'), ('out 1\nout 2\n', 'err 1\n'))
+
+    def test_log_lines_join_partial_lines(self):
+        ts = '2026-01-01T00:00:00Z'
+        self.assertEqual(list(self.client.log_lines('web')),
+                         [(ts, 1, 'out 1'), (ts, 2, 'err 1'), (ts, 1, 'out 2')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 """Automation & Monitoring Suite (Day 7) — minimal
-- Simple scheduler (interval-based)
+- Scheduler: interval or cron tasks on a worker pool, with overlap/catch-up policies and timeouts
 - Health checks (disk, memory)
 - Exposes a `/metrics` JSON endpoint on HTTP
 - Keeps in-memory execution history
@@ -11,21 +11,41 @@ Run:
 This is a small demo intended for local/practice use.
 """
 import argparse
+import concurrent.futures
+import heapq
 import http.server
+import itertools
 import json
+import multiprocessing
 import shutil
 import socketserver
 import threading
 import time
 from datetime import datetime
 
+from cron import CronExpr
+
 
 HISTORY = []
 HISTORY_LOCK = threading.Lock()
 
+# process tasks start from a fresh interpreter, not a fork of this threaded process
+# (a forked child could inherit HISTORY_LOCK or another lock held by a pool thread)
+MP = multiprocessing.get_context('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+
+# set in a process task's child: record_event() sends events to the parent through it
+_event_pipe = None
+
 
 def record_event(name, status, detail=None):
     entry = {'time': datetime.utcnow().isoformat() + 'Z', 'task': name, 'status': status, 'detail': detail}
+    if _event_pipe is not None:
+        _event_pipe.send(entry)
+        return
+    _add_event(entry)
+
+
+def _add_event(entry):
     with HISTORY_LOCK:
         HISTORY.append(entry)
         if len(HISTORY) > 200:
@@ -54,30 +74,186 @@ def sample_task_backup():
     record_event('backup', 'done')
 
 
+def _child_main(fn, conn):
+    """Entry point of a process task's child."""
+    global _event_pipe
+    _event_pipe = conn
+    fn()
+
+
+def _relay_events(conn):
+    """Add the events a process task's child sends to HISTORY until it exits."""
+    try:
+        while True:
+            _add_event(conn.recv())
+    except (EOFError, OSError):  # the child exited, or was killed mid-message
+        pass
+    finally:
+        conn.close()
+
+
 class Scheduler(threading.Thread):
-    def __init__(self, interval_seconds=60):
+    """Runs tasks at their due times on a pool of `workers` threads.
+
+    Due times are kept in a min-heap and the scheduler thread sleeps until the
+    earliest one, so it costs nothing while idle and fires within about a
+    millisecond. Tasks run on the pool, so a slow task does not hold up the
+    others; see add_task() for the per-task options.
+    """
+
+    def __init__(self, interval_seconds=60, workers=4):
         super().__init__(daemon=True)
-        self.interval = interval_seconds
-        self.tasks = []  # list of tuples (callable, interval_seconds, last_run)
-        self._stop = threading.Event()
+        self.interval = interval_seconds  # default period for add_task()
+        self.workers = workers
+        self.tasks = []
+        self._heap = []  # (due time, seq, 'run' or 'timeout', task, run)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = threading.Event()  # not _stop, which is a Thread method
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='task')
+
+    def add_task(self, func, every=None, cron=None, name=None, overlap='skip', catchup='skip', timeout=None,
+                 process=False, grace=1.0):
+        """Schedule `func` every `every` seconds (first run right away) or on a `cron` expression.
 
-    def add_task(self, func, every):
-        self.tasks.append({'fn': func, 'every': every, 'last': 0})
+        overlap: what to do when a run is due while the previous one is still
+          going: 'skip' it, 'queue' it (at most one run waits) or 'allow' it.
+        catchup: runs missed by more than `grace` seconds (e.g. after the
+          host was suspended) are dropped ('skip'), replaced by a single run
+          ('once') or all made up one after another ('all').
+        timeout: seconds from the start of a run after which it counts as
+          failed. A `process` task runs in a child process that is killed
+          then. A thread can't be killed: the run is reported as timed out
+          but keeps its worker, and its overlap slot, until it returns.
+        process: run `func` in a new interpreter (forkserver or spawn), so it
+          must be a module-level function; its record_event() calls are sent
+          back to this process's history.
+        """
+        if overlap not in ('skip', 'queue', 'allow') or catchup not in ('skip', 'once', 'all'):
+            raise ValueError('bad overlap or catchup policy')
+        if cron is None and every is None:
+            every = self.interval
+        task = {'fn': func, 'name': name or func.__name__, 'every': every, 'cron': CronExpr(cron) if cron else None,
+                'overlap': overlap, 'catchup': catchup, 'timeout': timeout, 'process': process, 'grace': grace,
+                'running': 0, 'queued': 0, 'last': 0, 'lag': None}
+        now = time.time()
+        with self._cond:
+            self.tasks.append(task)
+            self._push(task['cron'].next_after(now) if task['cron'] else now, 'run', task)
+        return task
 
     def stop(self):
-        self._stop.set()
+        self._stopped.set()
+        with self._cond:
+            self._cond.notify()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _push(self, when, kind, task, run=None):
+        heapq.heappush(self._heap, (when, next(self._seq), kind, task, run))
+        if self._heap[0][3] is task:
+            self._cond.notify()
+
+    def _next_time(self, task, after):
+        return task['cron'].next_after(after) if task['cron'] else after + task['every']
 
     def run(self):
-        while not self._stop.is_set():
-            now = time.time()
-            for t in self.tasks:
-                if now - t['last'] >= t['every']:
-                    try:
-                        t['fn']()
-                        t['last'] = now
-                    except Exception as e:
-                        record_event(t['fn'].__name__, 'error', str(e))
-            time.sleep(0.5)
+        while True:
+            with self._cond:
+                while not self._stopped.is_set():
+                    now = time.time()
+                    if self._heap and self._heap[0][0] <= now:
+                        when, _, kind, task, run = heapq.heappop(self._heap)
+                        break
+                    self._cond.wait(self._heap[0][0] - now if self._heap else None)
+                else:
+                    return
+                if kind == 'run':
+                    self._due(task, when, now)
+                else:
+                    self._expire(task, run)
+
+    def _due(self, task, when, now):
+        # occurrences from `when` up to now; only more than one if runs were missed
+        missed, following = 1, self._next_time(task, when)
+        if now - when > task['grace']:
+            while following <= now and missed < 10000:
+                missed += 1
+                following = self._next_time(task, following)
+            runs = {'skip': 0, 'once': 1, 'all': missed}[task['catchup']]
+            record_event(task['name'], 'missed', '%d run(s) missed, catching up %d' % (missed, runs))
+        else:
+            runs = 1
+        task['lag'] = now - when
+        for i in range(runs):
+            self._start(task, catching_up=i > 0)
+        self._push(following, 'run', task)
+
+    def _start(self, task, catching_up=False):
+        if task['running'] and task['overlap'] != 'allow':
+            if catching_up:
+                task['queued'] += 1
+            elif task['overlap'] == 'queue':
+                task['queued'] = max(task['queued'], 1)
+            else:
+                record_event(task['name'], 'skipped', 'previous run still going')
+            return
+        task['running'] += 1
+        run = {'done': False, 'timed_out': False, 'proc': None}
+        try:
+            self._pool.submit(self._execute, task, run)
+        except RuntimeError:  # stopped
+            task['running'] -= 1
+
+    def _execute(self, task, run):
+        record_event(task['name'], 'started')
+        detail = None
+        try:
+            if task['timeout']:
+                with self._cond:
+                    self._push(time.time() + task['timeout'], 'timeout', task, run)
+            if task['process']:
+                reader, writer = MP.Pipe(duplex=False)
+                proc = MP.Process(target=_child_main, args=(task['fn'], writer), daemon=True)
+                try:
+                    proc.start()  # not under self._cond: starting an interpreter takes a while
+                finally:
+                    writer.close()
+                with self._cond:
+                    run['proc'] = proc
+                    if run['timed_out']:  # expired while starting
+                        proc.kill()
+                _relay_events(reader)
+                proc.join()
+                status = 'done' if proc.exitcode == 0 else 'error'
+                if proc.exitcode:
+                    detail = 'exit code %d' % proc.exitcode
+            else:
+                task['fn']()
+                status = 'done'
+        except Exception as e:
+            status, detail = 'error', str(e)
+        with self._cond:
+            self._finish(task, run, status, detail)
+
+    def _expire(self, task, run):
+        if not (run['done'] or run['timed_out']):
+            run['timed_out'] = True
+            record_event(task['name'], 'timeout', 'no result after %ss' % task['timeout'])
+            if run['proc'] is not None:
+                run['proc'].kill()
+
+    def _finish(self, task, run, status, detail):
+        """Called with the lock held when a run returns; frees its overlap slot."""
+        run['done'] = True
+        task['running'] -= 1
+        task['last'] = time.time()
+        if not run['timed_out']:
+            record_event(task['name'], status, detail)
+        elif not task['process']:
+            record_event(task['name'], 'late', 'returned after its %ss timeout' % task['timeout'])
+        if task['queued'] and not task['running']:
+            task['queued'] -= 1
+            self._start(task)
 
 
 class MetricsHandler(http.server.BaseHTTPRequestHandler):
@@ -117,9 +293,10 @@ def run_http_server(port):
 def main():
     p = argparse.ArgumentParser()
     p.add_argument('--port', type=int, default=8000)
+    p.add_argument('--workers', type=int, default=4, help='Tasks that can run at the same time')
     args = p.parse_args()
 
-    sched = Scheduler()
+    sched = Scheduler(workers=args.workers)
     sched.add_task(sample_task_cleanup, every=10)
     sched.add_task(sample_task_backup, every=15)
     sched.start()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""Cron expressions for the automation_suite scheduler (Day 7)
+
+Five fields: minute hour day-of-month month day-of-week. Each field is '*',
+a number, a range 'a-b', a list 'a,b' or any of these with a '/step'; month
+and weekday names (jan, mon) and the @hourly, @daily, @weekly, @monthly and
+@yearly shorthands work too. As in cron, when both day fields are restricted
+a day matching either of them qualifies. Times are local.
+
+Usage:
+  python cron.py "*/15 9-17 * * mon-fri" --count 5
+"""
+import argparse
+import datetime
+import time
+
+ALIASES = {'@hourly': '0 * * * *', '@daily': '0 0 * * *', '@midnight': '0 0 * * *',
+           '@weekly': '0 0 * * 0', '@monthly': '0 0 1 * *', '@yearly': '0 0 1 1 *', '@annually': '0 0 1 1 *'}
+MONTHS = ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec']
+DAYS = ['sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat']
+# (lowest, highest, names) per field
+FIELDS = [(0, 59, None), (0, 23, None), (1, 31, None), (1, 12, MONTHS), (0, 7, DAYS)]
+
+
+def _value(text, low, names):
+    text = text.lower()
+    if names and text in names:
+        return names.index(text) + low
+    return int(text)
+
+
+def _parse_field(text, low, high, names):
+    values = set()
+    for part in text.split(','):
+        body, _, step = part.partition('/')
+        if body == '*':
+            start, end = low, high
+        else:
+            first, _, last = body.partition('-')
+            start = _value(first, low, names)
+            end = _value(last, low, names) if last else (high if step else start)
+        step = int(step) if step else 1
+        if not (low <= start <= end <= high) or step < 1:
+            raise ValueError('bad cron field: %r' % text)
+        values.update(range(start, end + 1, step))
+    return sorted(values)
+
+
+class CronExpr:
+    def __init__(self, expr):
+        self.expr = expr
+        fields = ALIASES.get(expr.strip().lower(), expr).split()
+        if len(fields) != 5:
+            raise ValueError('cron expression needs 5 fields: %r' % expr)
+        parsed = [_parse_field(f, *spec) for f, spec in zip(fields, FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        self.weekdays = {d % 7 for d in weekdays}  # 7 is Sunday too
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def __repr__(self):
+        return 'CronExpr(%r)' % self.expr
+
+    def _day_ok(self, d):
+        dom = d.day in self.days
+        dow = (d.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return dom and dow
+        return dom or dow
+
+    def next_after(self, t):
+        """First matching time (epoch seconds) strictly after `t`."""
+        d = datetime.datetime.fromtimestamp(t).replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = d.year + 5
+        while d.year <= limit:
+            if d.month not in self.months:
+                d = (d.replace(day=1) + datetime.timedelta(days=32)).replace(day=1, hour=0, minute=0)
+                continue
+            if not self._day_ok(d):
+                d = d.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+                continue
+            if d.hour not in self.hours:
+                later = [h for h in self.hours if h > d.hour]
+                if not later:
+                    d = d.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+                    continue
+                d = d.replace(hour=later[0], minute=0)
+            if d.minute not in self.minutes:
+                later = [m for m in self.minutes if m > d.minute]
+                if not later:
+                    d = d.replace(minute=0) + datetime.timedelta(hours=1)
+                    continue
+                d = d.replace(minute=later[0])
+            return d.timestamp()
+        raise ValueError('cron expression never matches: %r' % self.expr)
+
+
+def main():
+    p = argparse.ArgumentParser(description='Show the next times a cron expression fires')
+    p.add_argument('expr')
+    p.add_argument('--count', type=int, default=5)
+    args = p.parse_args()
+    t = time.time()
+    cron = CronExpr(args.expr)
+    for _ in range(args.count):
+        t = cron.next_after(t)
+        print(datetime.datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M (%a)'))
+
+
+if __name__ == '__main__':
+    main()